@@ -5,6 +5,7 @@ Protects endpoints with JWT authentication and provides current user context
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from functools import lru_cache
 from typing import Optional
 import uuid
 
@@ -16,6 +17,10 @@ from app.models.user import User
 # HTTP Bearer security scheme
 security = HTTPBearer()
 
+# The same few user ids arrive on every request; memoize string -> UUID parsing.
+# UUID is immutable, so sharing instances across requests is safe.
+parse_user_id = lru_cache(maxsize=4096)(uuid.UUID)
+
 
 class CurrentUser:
     """Current authenticated user context"""
@@ -73,7 +78,7 @@ def get_current_user(
 
     # Get user from database
     try:
-        user_uuid = uuid.UUID(token_data.user_id)
+        user_uuid = parse_user_id(token_data.user_id)
     except ValueError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -118,7 +123,7 @@ def get_current_user_optional(
 
     try:
         token_data = JWTAuth.decode_token(token)
-        user_uuid = uuid.UUID(token_data.user_id)
+        user_uuid = parse_user_id(token_data.user_id)
         db_user = db.query(User).filter(User.id == user_uuid).first()
 
         if db_user:
@@ -133,6 +138,42 @@ def get_current_user_optional(
     return None
 
 
+def get_session_user_id(request: Request) -> Optional[uuid.UUID]:
+    """
+    Session-based user ID, parsed once per request
+
+    Args:
+        request: FastAPI request
+
+    Returns:
+        User UUID from the session cookie, or None if not logged in
+    """
+    user_id = request.session.get("user_id")
+    if not user_id:
+        return None
+    try:
+        return parse_user_id(user_id)
+    except ValueError:
+        return None
+
+
+def require_session_user_id(
+    user_id: Optional[uuid.UUID] = Depends(get_session_user_id)
+) -> uuid.UUID:
+    """
+    Session-based user ID for endpoints that require login
+
+    Raises:
+        HTTPException: If there is no logged-in user in the session
+    """
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required",
+        )
+    return user_id
+
+
 def require_user_isolation(
     resource_user_id: uuid.UUID,
     current_user: CurrentUser = Depends(get_current_user)
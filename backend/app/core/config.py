@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from pydantic import Field
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
@@ -7,6 +8,9 @@ from dotenv import load_dotenv
 if os.path.exists(".env.dev"):
     load_dotenv(".env.dev")
 
+# backend/ - корень для файлов кэша приложения
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
 class Settings(BaseSettings):
     app_env: str = Field(default="dev", alias="APP_ENV")
     secret_key: str = Field(default="dev-secret", alias="SECRET_KEY")
@@ -23,8 +27,22 @@ class Settings(BaseSettings):
     postgres_user: str = Field(default="postgres", alias="POSTGRES_USER")
     postgres_password: str = Field(default="postgres", alias="POSTGRES_PASSWORD")
 
+    # Connection pool (ignored for SQLite)
+    db_pool_size: int = Field(default=max(5, 2 * (os.cpu_count() or 1)), alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=10, alias="DB_MAX_OVERFLOW")
+    db_pool_timeout: int = Field(default=30, alias="DB_POOL_TIMEOUT")
+    db_pool_recycle: int = Field(default=1800, alias="DB_POOL_RECYCLE")  # seconds
+    # Compiled SQL cache entries per engine (SQLAlchemy default is 500)
+    db_query_cache_size: int = Field(default=1200, alias="DB_QUERY_CACHE_SIZE")
+
     redis_host: str = Field(default="redis", alias="REDIS_HOST")
     redis_port: int = Field(default=6379, alias="REDIS_PORT")
+    # Seconds a cached latest EOD price lives in Redis (0 disables the cache)
+    price_cache_ttl: int = Field(default=3600, alias="PRICE_CACHE_TTL")
+    # Seconds the /users/ranking leaderboard is cached in Redis (0 disables the cache)
+    ranking_cache_ttl: int = Field(default=30, alias="RANKING_CACHE_TTL")
+    # Seconds a user row (email, name, usd_balance) is cached in Redis by user_id (0 disables the cache)
+    user_cache_ttl: int = Field(default=60, alias="USER_CACHE_TTL")
 
     qdrant_host: str = Field(default="qdrant", alias="QDRANT_HOST")
     qdrant_port: int = Field(default=6333, alias="QDRANT_PORT")
@@ -33,6 +51,11 @@ class Settings(BaseSettings):
     openai_base_url: str = Field(default="https://api.openai.com/v1", alias="OPENAI_BASE_URL")
     openai_model: str = Field(default="gpt-4o-mini", alias="OPENAI_MODEL")
 
+    # NasdaqTrader symbol list persisted between restarts (routers/symbols_external), one ticker per line
+    symbols_cache_path: str = Field(
+        default=str(BACKEND_DIR / "data" / "cache" / "nasdaq_symbols.txt"), alias="SYMBOLS_CACHE_PATH"
+    )
+
     # EOD Feature Flags
     eod_enable: bool = Field(default=False, alias="EOD_ENABLE")
     eod_source: str = Field(default="stooq", alias="EOD_SOURCE")
@@ -57,6 +80,14 @@ class Settings(BaseSettings):
     crypto_price_ttl_seconds: int = Field(default=60, alias="CRYPTO_PRICE_TTL_SECONDS")
     crypto_price_primary: str = Field(default="binance", alias="CRYPTO_PRICE_PRIMARY")
     crypto_allowed_symbols: str = Field(default="BTC,ETH,SOL,BNB,ADA,XRP,DOGE,AVAX,MATIC", alias="CRYPTO_ALLOWED_SYMBOLS")
+
+    # Positions bulk import: rows per transaction in /positions/bulk_json
+    positions_bulk_chunk_size: int = Field(default=1000, alias="POSITIONS_BULK_CHUNK_SIZE")
+    # Payloads larger than this go through COPY in one transaction (0 disables)
+    positions_bulk_copy_threshold: int = Field(default=1000, alias="POSITIONS_BULK_COPY_THRESHOLD")
+    # GET /positions response cache: seconds a cached list stays fresh (0 disables), max cached users
+    positions_cache_ttl: int = Field(default=60, alias="POSITIONS_CACHE_TTL")
+    positions_cache_size: int = Field(default=1024, alias="POSITIONS_CACHE_SIZE")
     
     # AI Model Defaults
     default_insights_model: str = Field(default="llama3.1:8b", alias="DEFAULT_INSIGHTS_MODEL")
@@ -96,6 +127,11 @@ class Settings(BaseSettings):
     def database_url(self) -> str:
         """Get database URL from environment or construct from individual components"""
         if self.database_url_env:
+            # Plain postgresql:// resolves to psycopg2 in SQLAlchemy 2.0; the app (bulk COPY import)
+            # is written for psycopg 3, so pin the driver unless one is given explicitly
+            for scheme in ("postgresql://", "postgres://"):
+                if self.database_url_env.startswith(scheme):
+                    return "postgresql+psycopg://" + self.database_url_env[len(scheme):]
             return self.database_url_env
         
         return (
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select, update
 from uuid import UUID
 from typing import Optional, Dict, Any
+from functools import lru_cache
 from decimal import Decimal
 from datetime import date
 
@@ -79,16 +80,23 @@ def delete_for_user(db: Session, user_id: UUID) -> bool:
     return True
 
 
-def validate_allocation_sum(allocation: Optional[Dict[str, Any]]) -> bool:
+def allocation_total(allocation: Dict[str, Any]) -> float:
+    """Sum of allocation percentages (non-numeric entries are ignored)"""
+    return sum(float(val) for val in allocation.values() if isinstance(val, (int, float, str)))
+
+
+def validate_allocation_sum(allocation: Optional[Dict[str, Any]], total: Optional[float] = None) -> bool:
     """
     Validate that asset allocation percentages sum to approximately 100%.
     Returns True if valid, False otherwise.
+    Pass total if it was already computed with allocation_total().
     """
     if not allocation:
         return True
     
     try:
-        total = sum(float(val) for val in allocation.values() if isinstance(val, (int, float, str)))
+        if total is None:
+            total = allocation_total(allocation)
         return 95.0 <= total <= 105.0  # Allow 5% tolerance
     except (ValueError, TypeError):
         return False
@@ -147,30 +155,47 @@ def compute_strategy_derived_fields(strategy: Strategy, current_portfolio_value:
     Compute derived fields for strategy output.
     This mimics the frontend calculation logic.
     """
-    result = {}
-    
     if current_portfolio_value is None:
         current_portfolio_value = Decimal("0")
     
+    # Memoized by the values the fields depend on (and today's date, used by target CAGR)
+    return dict(_derived_fields(
+        strategy.target_value,
+        strategy.target_date,
+        strategy.monthly_contribution,
+        strategy.expected_return,
+        current_portfolio_value,
+        date.today(),
+    ))
+
+
+@lru_cache(maxsize=512)
+def _derived_fields(
+    target_value: Optional[Decimal],
+    target_date: Optional[date],
+    monthly_contribution: Optional[Decimal],
+    expected_return: Optional[Decimal],
+    current_portfolio_value: Decimal,
+    today: date,
+) -> tuple:
+    result = {}
+    
     # Progress to Goal
-    if strategy.target_value and strategy.target_value > 0:
-        result["progress_to_goal"] = float((current_portfolio_value / strategy.target_value) * 100)
+    if target_value and target_value > 0:
+        result["progress_to_goal"] = float((current_portfolio_value / target_value) * 100)
     else:
         result["progress_to_goal"] = None
     
     # Target CAGR calculation
-    if strategy.target_date and strategy.target_value and strategy.target_value > 0 and current_portfolio_value > 0:
-        from datetime import datetime
-        
-        today = datetime.now().date()
-        years_remaining = max((strategy.target_date - today).days / 365.25, 0.01)
+    if target_date and target_value and target_value > 0 and current_portfolio_value > 0:
+        years_remaining = max((target_date - today).days / 365.25, 0.01)
         
         # Account for monthly contributions
-        if strategy.monthly_contribution:
-            contribution_growth = strategy.monthly_contribution * Decimal(str(12 * years_remaining))
-            target_without_contribution = strategy.target_value - contribution_growth
+        if monthly_contribution:
+            contribution_growth = monthly_contribution * Decimal(str(12 * years_remaining))
+            target_without_contribution = target_value - contribution_growth
         else:
-            target_without_contribution = strategy.target_value
+            target_without_contribution = target_value
             
         if target_without_contribution > 0:
             result["target_cagr"] = float((target_without_contribution / current_portfolio_value) ** (1 / years_remaining) - 1)
@@ -181,13 +206,14 @@ def compute_strategy_derived_fields(strategy: Strategy, current_portfolio_value:
     
     # Actual vs Target (simplified calculation)
     # In a real implementation, this would compare against historical performance
-    if strategy.expected_return and current_portfolio_value > 0:
+    if expected_return and current_portfolio_value > 0:
         # Simplified: assume user is meeting expectations for now
         result["actual_vs_target"] = "on_track"
     else:
         result["actual_vs_target"] = None
     
-    return result
+    # Tuple of items: the cached value stays immutable, callers get a fresh dict
+    return tuple(result.items())
 
 
 
@@ -2,8 +2,29 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from app.core.config import settings
 
-engine = create_engine(settings.database_url, echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+def _engine_options(url: str) -> dict:
+    """Pool settings for server databases; SQLite keeps SQLAlchemy defaults"""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,  # drop connections closed by the server before handing them out
+    }
+
+
+engine = create_engine(
+    settings.database_url,
+    echo=False,
+    future=True,
+    query_cache_size=settings.db_query_cache_size,
+    **_engine_options(settings.database_url),
+)
+# Request-scoped sessions: keep loaded attributes after commit instead of re-SELECTing them on access
+SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
 
 def get_db() -> Session:
     db = SessionLocal()
@@ -11,6 +11,7 @@ from app.routers import admin_feature_flags, admin_api_providers, admin_rate_lim
 from app.database import SessionLocal
 from app.db.seed import seed_demo_data
 
+import asyncio
 import os
 import logging
 
@@ -143,6 +144,19 @@ def startup_event():
             db.close()
 
 
+@app.on_event("startup")
+async def start_symbols_refresh():
+    """Фоновое обновление справочника тикеров NasdaqTrader"""
+    app.state.symbols_refresh_task = asyncio.create_task(symbols_external.refresh_symbols_loop())
+
+
+@app.on_event("shutdown")
+async def stop_symbols_refresh():
+    task = getattr(app.state, "symbols_refresh_task", None)
+    if task is not None:
+        task.cancel()
+
+
 @app.get("/", tags=["root"])
 def root():
     return {"status": "ok", "env": settings.app_env}
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, String, ForeignKey, Date, Numeric, DateTime, Enum
+from sqlalchemy import Column, String, ForeignKey, Date, Numeric, DateTime, Enum, UniqueConstraint, Index, text
 from app.dbtypes import GUID
 import uuid
 from datetime import datetime
@@ -27,3 +27,19 @@ class Position(Base):
 
     user = relationship("User", back_populates="positions")
 
+    __table_args__ = (
+        # Одна позиция на (пользователь, тикер, счёт); позиции без счёта (NULL) тоже не дублируются
+        UniqueConstraint(
+            "user_id", "symbol", "account",
+            name="uq_positions_user_symbol_account",
+            postgresql_nulls_not_distinct=True,
+        ),
+        Index("ix_positions_user_id_id", "user_id", "id"),
+        # Позиции без USD-кэша (рейтинг, cash-ledger): index-only scan в PostgreSQL
+        Index(
+            "ix_positions_nonusd", "user_id",
+            postgresql_include=["symbol", "quantity", "buy_price"],
+            postgresql_where=text("symbol <> 'USD'"),
+        ),
+    )
+
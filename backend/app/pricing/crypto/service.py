@@ -13,6 +13,13 @@ from .coingecko_provider import CoinGeckoPriceProvider
 
 logger = logging.getLogger(__name__)
 
+# Crypto whitelist from config; fixed for the life of the process
+ALLOWED_SYMBOLS: frozenset[str] = frozenset(
+    symbol.strip().upper()
+    for symbol in settings.crypto_allowed_symbols.split(",")
+)
+ALLOWED_SYMBOLS_SORTED_CSV: str = ", ".join(sorted(ALLOWED_SYMBOLS))
+
 
 class CryptoPriceService:
     """Service for getting crypto prices with caching and fallback providers"""
@@ -22,11 +29,7 @@ class CryptoPriceService:
         self._cache_ttl = timedelta(seconds=settings.crypto_price_ttl_seconds)
         self._primary_provider = settings.crypto_price_primary.lower()
         
-        # Parse allowed symbols from config
-        self._allowed_symbols = set(
-            symbol.strip().upper() 
-            for symbol in settings.crypto_allowed_symbols.split(",")
-        )
+        self._allowed_symbols = ALLOWED_SYMBOLS
         
         logger.info(f"CryptoPriceService initialized with primary={self._primary_provider}, "
                    f"ttl={self._cache_ttl.total_seconds()}s, "
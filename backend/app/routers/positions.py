@@ -1,20 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy import Column, Date, Integer, MetaData, Table, bindparam, select, update, delete, and_, or_, case, cast, func, literal, literal_column
+from sqlalchemy.orm import aliased
 from sqlalchemy.dialects.postgresql import insert
-from app.database import get_db
+from app.database import get_db, SessionLocal
 from app.models.position import Position, AssetClass
+from app.models.user import User
 from app.schemas import PositionCreate, PositionUpdate, PositionOut, BulkPositionResult, SellPositionRequest
 from app.services.auto_price_loader import load_price_for_symbol, load_prices_for_symbols
-from app.services.price_eod import PriceEODRepository
+from app.services.positions_cache import (
+    bump_positions_version, get_cached_positions, positions_version, store_cached_positions,
+)
+from app.services.user_cache import invalidate_user_cache
 from app.models.price_eod import PriceEOD
-from app.pricing.crypto.service import get_crypto_price_service
+from app.services.price_eod import eod_price_id
+from app.pricing.crypto.service import (
+    ALLOWED_SYMBOLS as ALLOWED_CRYPTO_SYMBOLS,
+    ALLOWED_SYMBOLS_SORTED_CSV as ALLOWED_CRYPTO_SYMBOLS_CSV,
+    get_crypto_price_service,
+)
 from app.core.config import settings
 from app.core.auth_middleware import get_current_user, CurrentUser
-from uuid import UUID
+from uuid import UUID, uuid4
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 from datetime import datetime
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -33,6 +45,70 @@ def get_user_id_from_request_or_jwt(
     return current_user.user_id
 
 
+def _auto_load_price(symbol: str, user_id: UUID) -> None:
+    """
+    Фоновая автозагрузка цены для нового символа.
+
+    Выполняется после отправки ответа, поэтому открывает собственную сессию:
+    сессия запроса к этому моменту уже закрыта.
+    """
+    db = SessionLocal()
+    try:
+        load_price_for_symbol(symbol, db)
+        # Новые цены должны попасть в GET /positions владельца сразу
+        bump_positions_version(user_id)
+        logger.info(f"Auto-loaded price data for new position: {symbol}")
+    except Exception as e:
+        # Позиция уже создана, ошибка загрузки цены на неё не влияет
+        logger.warning(f"Failed to auto-load price for {symbol}: {e}")
+    finally:
+        db.close()
+
+
+def _auto_load_prices(symbols: List[str], user_id: UUID) -> None:
+    """Фоновая автозагрузка цен для списка новых символов (см. _auto_load_price)"""
+    db = SessionLocal()
+    try:
+        load_results = load_prices_for_symbols(symbols, db)
+        bump_positions_version(user_id)
+        loaded_count = sum(1 for success in load_results.values() if success)
+        logger.info(f"Auto-loaded prices for {loaded_count}/{len(symbols)} new symbols")
+    except Exception as e:
+        logger.warning(f"Failed to auto-load prices for bulk operation: {e}")
+    finally:
+        db.close()
+
+
+def _bound(value, column):
+    """Параметр с типом колонки: PostgreSQL должен знать тип даже для NULL"""
+    return cast(literal(value), column.type)
+
+
+def _merge_lot(quantity, buy_price, buy_date) -> dict:
+    """
+    SET-выражения для добавления нового лота к существующей позиции.
+
+    Арифметика выполняется в БД (numeric): количество суммируется, цена покупки
+    становится средневзвешенной, дата покупки - более поздней из двух.
+    Аргументы - SQL-выражения (EXCLUDED-колонки INSERT ... ON CONFLICT).
+    """
+    return {
+        "quantity": Position.quantity + quantity,
+        # Средневзвешенная цена = (старая_цена * старое_количество + новая_цена * новое_количество) / общее_количество
+        "buy_price": case(
+            (buy_price.is_(None), Position.buy_price),
+            (Position.buy_price.is_(None), buy_price),
+            else_=(Position.buy_price * Position.quantity + buy_price * quantity) / (Position.quantity + quantity),
+        ),
+        "buy_date": case(
+            (buy_date.is_(None), Position.buy_date),
+            (Position.buy_date.is_(None), buy_date),
+            (buy_date > Position.buy_date, buy_date),
+            else_=Position.buy_date,
+        ),
+    }
+
+
 async def get_crypto_price_for_position(symbol: str) -> tuple[Optional[Decimal], Optional[datetime]]:
     """Get crypto price for position symbol"""
     if not settings.feature_crypto_positions:
@@ -53,101 +129,242 @@ async def get_crypto_price_for_position(symbol: str) -> tuple[Optional[Decimal],
         return None, None
 
 
+def _positions_with_prices():
+    """
+    SELECT позиций пользователя (:user_id) с EOD ценами одним запросом:
+    последняя цена (кроме крипто) и, если нет buy_price, цена на дату
+    добавления позиции как reference_price.
+    """
+    latest = aliased(PriceEOD)
+    reference = aliased(PriceEOD)
+    return (
+        select(
+            Position.id,
+            Position.user_id,
+            Position.symbol,
+            Position.quantity,
+            Position.buy_price,
+            Position.buy_date,
+            Position.date_added,
+            Position.currency,
+            Position.account,
+            Position.asset_class,
+            latest.close.label("last_price"),
+            latest.date.label("last_date"),
+            reference.close.label("reference_price"),
+            reference.date.label("reference_date"),
+        )
+        .select_from(Position)
+        .outerjoin(latest, and_(
+            Position.asset_class != AssetClass.CRYPTO,
+            latest.id == eod_price_id(),
+        ))
+        .outerjoin(reference, and_(
+            or_(Position.buy_price.is_(None), Position.buy_price == 0),
+            reference.id == eod_price_id(on_date=func.date(Position.date_added, type_=Date)),
+        ))
+        .where(Position.user_id == bindparam("user_id"))
+    )
+
+
+# Запросы строятся один раз при импорте модуля, значения передаются через bindparam
+_SELECT_POSITIONS_WITH_PRICES = _positions_with_prices()
+
+# Имя owner_id, а не user_id: имена колонок зарезервированы для SET в UPDATE
+_OWNED_POSITION = and_(
+    Position.id == bindparam("position_id"),
+    Position.user_id == bindparam("owner_id"),
+)
+_DELETE_OWNED_POSITION = delete(Position).where(_OWNED_POSITION).returning(Position.id)
+
+# Для INSERT ... ON CONFLICT ... RETURNING: xmax = 0 только у вставленных (не обновлённых) строк
+_INSERTED = (literal_column("xmax") == 0).label("inserted")
+
+
+def _merge_on_conflict(stmt):
+    """ON CONFLICT (user_id, symbol, account) DO UPDATE: слить лот (_merge_lot по EXCLUDED)"""
+    table = Position.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.symbol, table.c.account],
+        set_={
+            **_merge_lot(stmt.excluded.quantity, stmt.excluded.buy_price, stmt.excluded.buy_date),
+            "currency": stmt.excluded.currency,
+        },
+    )
+
+
+def _upsert_lots():
+    """
+    INSERT ... ON CONFLICT (user_id, symbol, account) DO UPDATE для пакета лотов.
+
+    Новый ключ создаёт позицию, существующий - сливает лот с ней (_merge_lot
+    по EXCLUDED). RETURNING inserted отличает вставленные строки от слитых.
+    """
+    return _merge_on_conflict(insert(Position.__table__)).returning(_INSERTED)
+
+
+_UPSERT_LOTS = _upsert_lots()
+
+# Временная таблица для импорта через COPY (живёт до конца транзакции).
+# round - номер повтора ключа (symbol, account) в запросе, см. _lot_rounds
+_IMPORT_COLUMNS = ["id", "user_id", "symbol", "quantity", "buy_price", "buy_date", "date_added", "currency", "account"]
+_POSITIONS_IMPORT = Table(
+    "positions_import",
+    MetaData(),
+    Column("round", Integer, nullable=False),
+    *[Column(name, Position.__table__.c[name].type) for name in _IMPORT_COLUMNS],
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+_COPY_POSITIONS_IMPORT = f"COPY positions_import (round, {', '.join(_IMPORT_COLUMNS)}) FROM STDIN"
+_UPSERT_IMPORTED_LOTS = _merge_on_conflict(
+    insert(Position.__table__).from_select(
+        _IMPORT_COLUMNS,
+        select(*[_POSITIONS_IMPORT.c[name] for name in _IMPORT_COLUMNS])
+        .where(_POSITIONS_IMPORT.c.round == bindparam("round")),
+    )
+).returning(_INSERTED)
+
+
+def _lot_rounds(user_id: UUID, positions: List[PositionCreate]) -> List[List[dict]]:
+    """
+    Разбить лоты на раунды для INSERT ... ON CONFLICT.
+
+    В одном INSERT строка не может обновиться дважды, поэтому повторы ключа
+    (symbol, account) уходят в следующие раунды (по порядку в запросе).
+    """
+    rounds = []
+    occurrences = {}
+    for pos_data in positions:
+        key = (pos_data.symbol, pos_data.account)
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        if occurrence == len(rounds):
+            rounds.append([])
+        rounds[occurrence].append({
+            "user_id": user_id,
+            "symbol": pos_data.symbol,
+            "quantity": pos_data.quantity,
+            "buy_price": pos_data.buy_price,
+            "buy_date": pos_data.buy_date,
+            "currency": pos_data.currency or "USD",
+            "account": pos_data.account,
+        })
+    return rounds
+
+
+def _copy_import_lots(db: Session, rounds: List[List[dict]]):
+    """
+    Импорт больших пакетов: COPY во временную таблицу, затем по одному
+    INSERT ... SELECT ... ON CONFLICT на раунд. Всё в текущей транзакции.
+    Возвращает RETURNING-строки (inserted) всех раундов.
+    """
+    connection = db.connection()
+    _POSITIONS_IMPORT.create(connection)
+    date_added = datetime.utcnow()
+    with connection.connection.driver_connection.cursor() as cursor:
+        with cursor.copy(_COPY_POSITIONS_IMPORT) as copy:
+            for number, rows in enumerate(rounds):
+                for row in rows:
+                    copy.write_row((
+                        number, uuid4(), row["user_id"], row["symbol"], row["quantity"], row["buy_price"],
+                        row["buy_date"], date_added, row["currency"], row["account"],
+                    ))
+    results = []
+    for number in range(len(rounds)):
+        results.extend(db.execute(_UPSERT_IMPORTED_LOTS, {"round": number}))
+    return results
+
+
+def _upsert_lot(db: Session, **values):
+    """
+    Создать позицию или добавить лот к существующей (пересчёт цены и даты - в SQL).
+
+    Один INSERT ... ON CONFLICT, без гонки между проверкой и вставкой. Возвращает
+    (Position, inserted) или None, если под тем же тикером и счётом уже есть
+    позиция другого класса актива (такие не сливаются).
+    """
+    stmt = insert(Position).values(**values)
+    return db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Position.user_id, Position.symbol, Position.account],
+            set_=_merge_lot(stmt.excluded.quantity, stmt.excluded.buy_price, stmt.excluded.buy_date),
+            where=Position.asset_class == stmt.excluded.asset_class
+        ).returning(Position, _INSERTED)
+    ).one_or_none()
+
+
+def _use_copy_import(db: Session, count: int) -> bool:
+    """COPY доступен только через psycopg (PostgreSQL) и нужен лишь большим пакетам"""
+    threshold = settings.positions_bulk_copy_threshold
+    return 0 < threshold < count and db.get_bind().dialect.driver == "psycopg"
+
+
+def _load_positions(db: Session, user_id: UUID) -> List[dict]:
+    """Позиции пользователя с EOD ценами (синхронная часть get_positions)"""
+    rows = db.execute(_SELECT_POSITIONS_WITH_PRICES, {"user_id": user_id}).mappings().all()
+    return [dict(row) for row in rows]
+
+
 @router.get("", response_model=List[PositionOut])
 async def get_positions(
+    request: Request,
+    response: Response,
     user_id: UUID = Depends(get_user_id_from_request_or_jwt),
     db: Session = Depends(get_db)
 ):
     """Получить все позиции пользователя с последними ценами (requires JWT authentication)"""
-    positions = db.execute(
-        select(Position).where(Position.user_id == user_id)
-    ).scalars().all()
-    
-    # Присоединяем последние цены из EOD таблицы
-    price_repo = PriceEODRepository(db)
-    
-    result = []
-    for pos in positions:
-        position_dict = {
-            "id": pos.id,
-            "user_id": pos.user_id,
-            "symbol": pos.symbol,
-            "quantity": pos.quantity,
-            "buy_price": pos.buy_price,
-            "buy_date": pos.buy_date,
-            "date_added": pos.date_added,
-            "currency": pos.currency,
-            "account": pos.account,
-            "asset_class": pos.asset_class,
-        }
-        
-        # Получаем последнюю цену в зависимости от типа актива
-        latest_price = None
-        latest_date = None
-        
-        if pos.asset_class == AssetClass.CRYPTO:
-            # Для крипто используем crypto price service
-            crypto_price, crypto_timestamp = await get_crypto_price_for_position(pos.symbol)
+    cached = get_cached_positions(user_id)
+    if cached is None:
+        # Версию читаем до запроса: изменение во время запроса сделает результат устаревшим
+        version = positions_version(user_id)
+        # Запрос к БД синхронный - выполняем в пуле потоков, не блокируя event loop
+        rows = await run_in_threadpool(_load_positions, db, user_id)
+        cached = store_cached_positions(user_id, version, rows)
+    etag, rows = cached
+
+    # Крипто цены живые и в кэш не входят - для таких портфелей ETag не выдаём
+    if not any(row["asset_class"] == AssetClass.CRYPTO for row in rows):
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    # Для крипто используем crypto price service: все символы запрашиваем параллельно
+    crypto_symbols = sorted({row["symbol"] for row in rows if row["asset_class"] == AssetClass.CRYPTO})
+    crypto_prices = dict(zip(
+        crypto_symbols,
+        await asyncio.gather(*(get_crypto_price_for_position(symbol) for symbol in crypto_symbols)),
+    ))
+
+    # Строки из кэша не изменяем: копируются только крипто позиции с живой ценой
+    positions = []
+    for position_dict in rows:
+        if position_dict["asset_class"] == AssetClass.CRYPTO:
+            crypto_price, crypto_timestamp = crypto_prices[position_dict["symbol"]]
             if crypto_price:
-                latest_price = crypto_price
-                latest_date = crypto_timestamp.date() if crypto_timestamp else None
-        else:
-            # Для акций используем EOD цены (пробуем разные варианты символа)
-            symbols_to_try = [
-                pos.symbol,
-                pos.symbol.upper(),
-                pos.symbol.lower(),
-                pos.symbol.replace('.US', '.us'),
-                pos.symbol.replace('.us', '.US'),
-                pos.symbol.replace('.US', ''),
-                pos.symbol.replace('.us', '')
-            ]
-            
-            for symbol_variant in symbols_to_try:
-                latest_price_eod = price_repo.get_latest_price(symbol_variant)
-                if latest_price_eod:
-                    latest_price = latest_price_eod.close
-                    latest_date = latest_price_eod.date
-                    break
-        
-        if latest_price:
-            position_dict["last_price"] = latest_price
-            position_dict["last_date"] = latest_date
-
-        # Если нет buy_price, получаем цену на дату добавления позиции как reference_price
-        if not pos.buy_price and pos.date_added:
-            from datetime import date
-            added_date = pos.date_added.date()
-
-            # Пробуем разные варианты символа для reference_price
-            price_on_added_date = None
-            for symbol_variant in symbols_to_try:
-                price_on_added_date = price_repo.get_price_on_date(symbol_variant, added_date)
-                if price_on_added_date:
-                    break
-
-            if price_on_added_date:
-                position_dict["reference_price"] = price_on_added_date.close
-                position_dict["reference_date"] = added_date
-        
-        result.append(position_dict)
+                position_dict = {
+                    **position_dict,
+                    "last_price": crypto_price,
+                    "last_date": crypto_timestamp.date() if crypto_timestamp else None,
+                }
+        positions.append(position_dict)
     
-    return result
+    return positions
 
 
 @router.post("", response_model=PositionOut)
-async def create_position(
+def create_position(
     position_data: PositionCreate,
+    background_tasks: BackgroundTasks,
     user_id: UUID = Depends(get_user_id_from_request_or_jwt),
     db: Session = Depends(get_db)
 ):
     """Создать новую позицию или добавить к существующей (requires JWT authentication)"""
     try:
         # Специальная обработка для USD - используем баланс вместо позиции
-        symbol = position_data.symbol.upper().strip()
+        symbol = position_data.symbol
         if symbol == "USD":
             # Обновляем баланс пользователя вместо создания USD позиции
-            from app.models.user import User
             user = db.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
             if not user:
                 raise HTTPException(status_code=404, detail="User not found")
@@ -157,6 +374,7 @@ async def create_position(
             user.usd_balance += position_data.quantity
             
             db.commit()
+            invalidate_user_cache(user_id)
             return {"message": f"USD balance updated by {position_data.quantity}"}
         
         # Валидация для крипто-позиций
@@ -166,77 +384,42 @@ async def create_position(
                 raise HTTPException(status_code=403, detail="Crypto positions feature is disabled")
             
             # Проверяем, что символ в whitelist
-            crypto_service = get_crypto_price_service()
-            if not crypto_service._is_symbol_allowed(symbol):
+            if symbol.upper() not in ALLOWED_CRYPTO_SYMBOLS:
                 raise HTTPException(
                     status_code=422, 
-                    detail=f"Crypto symbol {symbol} is not allowed. Allowed symbols: {', '.join(sorted(crypto_service._allowed_symbols))}"
-                )
-        
-        # Проверяем существующую позицию по (user_id, symbol, account, asset_class)
-        existing = db.execute(
-            select(Position).where(
-                and_(
-                    Position.user_id == user_id,
-                    Position.symbol == symbol,
-                    Position.account == position_data.account,
-                    Position.asset_class == asset_class
+                    detail=f"Crypto symbol {symbol} is not allowed. Allowed symbols: {ALLOWED_CRYPTO_SYMBOLS_CSV}"
                 )
-            )
-        ).scalar_one_or_none()
         
-        if existing:
-            # Обновляем существующую позицию - добавляем количество
-            existing.quantity += position_data.quantity
-            
-            # Пересчитываем средневзвешенную цену покупки
-            if position_data.buy_price is not None:
-                if existing.buy_price is not None:
-                    # Средневзвешенная цена = (старая_цена * старое_количество + новая_цена * новое_количество) / общее_количество
-                    total_cost_old = existing.buy_price * (existing.quantity - position_data.quantity)
-                    total_cost_new = position_data.buy_price * position_data.quantity
-                    existing.buy_price = (total_cost_old + total_cost_new) / existing.quantity
-                else:
-                    existing.buy_price = position_data.buy_price
-            
-            # Обновляем дату покупки на более позднюю
-            if position_data.buy_date is not None:
-                if existing.buy_date is None or position_data.buy_date > existing.buy_date:
-                    existing.buy_date = position_data.buy_date
-            
-            db.commit()
-            db.refresh(existing)
-            return existing
-        else:
-            # Создаем новую позицию
-            position = Position(
-                user_id=user_id,
-                symbol=symbol,
-                quantity=position_data.quantity,
-                buy_price=position_data.buy_price,
-                buy_date=position_data.buy_date,
-                date_added=datetime.utcnow(),
-                currency=position_data.currency or "USD",
-                account=position_data.account,
-                asset_class=asset_class
-            )
-            
-            db.add(position)
-            db.commit()
-            db.refresh(position)
-            
-            # Автоматически загружаем цену для нового символа (только для акций)
+        # Новая позиция или лот к существующей - одним запросом
+        row = _upsert_lot(
+            db,
+            user_id=user_id,
+            symbol=symbol,
+            quantity=position_data.quantity,
+            buy_price=position_data.buy_price,
+            buy_date=position_data.buy_date,
+            date_added=datetime.utcnow(),
+            currency=position_data.currency or "USD",
+            account=position_data.account,
+            asset_class=asset_class
+        )
+        if row is None:
+            raise ValueError(f"Position {symbol} already exists with a different asset class")
+        position, created = row
+
+        # Сериализуем до commit, чтобы не перечитывать истёкшие атрибуты
+        result = PositionOut.model_validate(position)
+        db.commit()
+        bump_positions_version(user_id)
+
+        if created:
+            # Автоматически загружаем цену для нового символа (только для акций) после ответа
             if asset_class == AssetClass.EQUITY:
-                try:
-                    load_price_for_symbol(symbol, db)
-                    logger.info(f"Auto-loaded price data for new equity position: {symbol}")
-                except Exception as e:
-                    logger.warning(f"Failed to auto-load price for {symbol}: {e}")
-                    # Не прерываем создание позиции из-за ошибки загрузки цены
+                background_tasks.add_task(_auto_load_price, symbol, user_id)
             elif asset_class == AssetClass.CRYPTO:
                 logger.info(f"Created new crypto position: {symbol} (prices will be fetched on-demand)")
-            
-            return position
+
+        return result
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to create position: {str(e)}")
@@ -245,92 +428,59 @@ async def create_position(
 @router.post("/bulk_json", response_model=BulkPositionResult)
 def bulk_create_positions(
     positions: List[PositionCreate],
+    background_tasks: BackgroundTasks,
     user_id: UUID = Depends(get_user_id_from_request_or_jwt),
     db: Session = Depends(get_db)
 ):
-    """Создать или обновить множество позиций за раз (requires JWT authentication)"""
+    """
+    Создать или обновить множество позиций за раз (requires JWT authentication).
+
+    Каждая порция коммитится отдельно: ошибка в порции откатывает только её,
+    строки порции попадают в failed/errors, уже сохранённые порции остаются.
+    """
     inserted = 0
     updated = 0
     failed = 0
     errors = []
-    
-    try:
-        for pos_data in positions:
-            try:
-                # Проверяем существующую позицию по (user_id, symbol, account)
-                existing = db.execute(
-                    select(Position).where(
-                        and_(
-                            Position.user_id == user_id,
-                            Position.symbol == pos_data.symbol.upper().strip(),
-                            Position.account == pos_data.account
-                        )
-                    )
-                ).scalar_one_or_none()
-                
-                if existing:
-                    # Обновляем существующую позицию - добавляем количество
-                    existing.quantity += pos_data.quantity
-                    
-                    # Пересчитываем средневзвешенную цену покупки
-                    if pos_data.buy_price is not None:
-                        if existing.buy_price is not None:
-                            # Средневзвешенная цена = (старая_цена * старое_количество + новая_цена * новое_количество) / общее_количество
-                            total_cost_old = existing.buy_price * (existing.quantity - pos_data.quantity)
-                            total_cost_new = pos_data.buy_price * pos_data.quantity
-                            existing.buy_price = (total_cost_old + total_cost_new) / existing.quantity
-                        else:
-                            existing.buy_price = pos_data.buy_price
-                    
-                    # Обновляем дату покупки на более позднюю
-                    if pos_data.buy_date is not None:
-                        if existing.buy_date is None or pos_data.buy_date > existing.buy_date:
-                            existing.buy_date = pos_data.buy_date
-                    
-                    if pos_data.currency is not None:
-                        existing.currency = pos_data.currency
-                    if pos_data.account is not None:
-                        existing.account = pos_data.account
-                    updated += 1
-                else:
-                    # Создаем новую позицию
-                    new_position = Position(
-                        user_id=user_id,
-                        symbol=pos_data.symbol.upper().strip(),
-                        quantity=pos_data.quantity,
-                        buy_price=pos_data.buy_price,
-                        buy_date=pos_data.buy_date,
-                        currency=pos_data.currency or "USD",
-                        account=pos_data.account
-                    )
-                    db.add(new_position)
-                    inserted += 1
-                    
-            except Exception as e:
-                failed += 1
-                errors.append(f"Failed to process {pos_data.symbol}: {str(e)}")
-        
-        db.commit()
-        
-        # Автоматически загружаем цены для всех новых символов
-        new_symbols = set()
-        for pos_data in positions:
-            symbol = pos_data.symbol.upper().strip()
-            if symbol != 'USD':
-                new_symbols.add(symbol)
-        
-        if new_symbols:
-            try:
-                load_results = load_prices_for_symbols(list(new_symbols), db)
-                loaded_count = sum(1 for success in load_results.values() if success)
-                logger.info(f"Auto-loaded prices for {loaded_count}/{len(new_symbols)} new symbols")
-            except Exception as e:
-                logger.warning(f"Failed to auto-load prices for bulk operation: {e}")
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Bulk operation failed: {str(e)}")
-    
+    new_symbols = set()
+    chunk_size = max(1, settings.positions_bulk_chunk_size)
+
+    # Коммитим порциями, чтобы транзакции оставались короткими на больших импортах;
+    # очень большой импорт идёт через COPY одной транзакцией
+    use_copy = _use_copy_import(db, len(positions))
+    step = len(positions) if use_copy else chunk_size
+    for chunk_start in range(0, len(positions), step):
+        chunk = positions[chunk_start:chunk_start + step]
+        try:
+            rounds = _lot_rounds(user_id, chunk)
+
+            # Новые позиции вставляются, лоты к существующим сливаются в SQL
+            if use_copy:
+                results = _copy_import_lots(db, rounds)
+            else:
+                results = [row for rows in rounds for row in db.execute(_UPSERT_LOTS, rows)]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            failed += len(chunk)
+            # Только сообщение драйвера: полный текст ошибки SQLAlchemy содержит все параметры порции
+            error = f"Rows {chunk_start + 1}-{chunk_start + len(chunk)}: {getattr(e, 'orig', None) or e}"
+            errors.append(error)
+            logger.warning(f"Bulk positions import for user {user_id} failed: {error}")
+            continue
+
+        for row in results:
+            if row.inserted:
+                inserted += 1
+            else:
+                updated += 1
+        bump_positions_version(user_id)
+        new_symbols.update(pos_data.symbol for pos_data in chunk if pos_data.symbol != 'USD')
+
+    # Автоматически загружаем цены для всех сохранённых символов
+    if new_symbols:
+        background_tasks.add_task(_auto_load_prices, sorted(new_symbols), user_id)
+
     return BulkPositionResult(
         inserted=inserted,
         updated=updated,
@@ -347,34 +497,38 @@ def update_position(
     db: Session = Depends(get_db)
 ):
     """Частично обновить позицию (requires JWT authentication and user isolation)"""
-    position = db.execute(
-        select(Position).where(
-            and_(
-                Position.id == position_id,
-                Position.user_id == user_id
-            )
-        )
-    ).scalar_one_or_none()
-    
-    if not position:
-        raise HTTPException(status_code=404, detail="Position not found")
-    
+    owned = {"position_id": position_id, "owner_id": user_id}
+    # Обновляем только переданные поля
+    update_data = position_data.model_dump(exclude_unset=True)
+
     try:
-        # Обновляем только переданные поля
-        update_data = position_data.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(position, field, value)
-        
+        if update_data:
+            # Проверка владельца и обновление одним запросом: нет строки - нет позиции
+            position = db.execute(
+                update(Position).where(_OWNED_POSITION).values(**update_data).returning(Position),
+                owned
+            ).scalar_one_or_none()
+        else:
+            # Нечего обновлять: выборка по первичному ключу, владельца проверяем здесь
+            position = db.get(Position, position_id)
+            if position is not None and position.user_id != user_id:
+                position = None
+
+        # Сериализуем до commit, чтобы не перечитывать истёкшие атрибуты
+        result = PositionOut.model_validate(position) if position else None
         db.commit()
-        db.refresh(position)
-        
-        return position
+        if result is not None:
+            bump_positions_version(user_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to update position: {str(e)}")
 
+    if result is None:
+        raise HTTPException(status_code=404, detail="Position not found")
+    return result
+
 
-@router.post("/sell", response_model=PositionOut)
+@router.post("/sell", response_model=Union[PositionOut, Dict[str, str]])
 def sell_position(
     sell_data: SellPositionRequest,
     user_id: UUID = Depends(get_user_id_from_request_or_jwt),
@@ -382,53 +536,66 @@ def sell_position(
 ):
     """Продать часть позиции за USD (requires JWT authentication and user isolation)"""
     try:
-        # Находим позицию для продажи
-        position = db.execute(
-            select(Position).where(
+        # Один запрос: списание с проверкой владельца и остатка (UPDATE positions в CTE)
+        # и зачисление выручки на USD баланс пользователя по его результату.
+        # Нет строки - позиции нет или продаётся больше, чем есть
+        quantity = _bound(sell_data.quantity, Position.quantity)
+        sold = (
+            update(Position)
+            .where(
                 and_(
                     Position.id == sell_data.position_id,
-                    Position.user_id == user_id
+                    Position.user_id == user_id,
+                    Position.quantity >= quantity
                 )
             )
-        ).scalar_one_or_none()
-        
-        if not position:
-            raise HTTPException(status_code=404, detail="Position not found")
-        
-        if position.quantity < sell_data.quantity:
-            raise HTTPException(status_code=400, detail="Insufficient quantity to sell")
-        
-        # Уменьшаем количество в позиции
-        position.quantity -= sell_data.quantity
-        
-        # Если продали все, удаляем позицию
-        if position.quantity == 0:
-            db.delete(position)
+            .values(quantity=Position.quantity - quantity)
+            .returning(*Position.__table__.c)
+            .cte("sold")
+        )
+        price = func.coalesce(_bound(sell_data.sell_price, Position.buy_price), sold.c.buy_price, 0)
+        credited = (
+            update(User)
+            .where(User.id == sold.c.user_id)
+            .values(usd_balance=func.coalesce(User.usd_balance, 0) + quantity * price)
+            .returning(User.id)
+            .cte("credited")
+        )
+        position = db.execute(
+            select(sold, select(func.count()).select_from(credited).scalar_subquery().label("credited"))
+        ).mappings().one_or_none()
+
+        result = None
+        missing = False
+        if position is None:
+            # Ничего не списано: чужая/несуществующая позиция (404) или нехватка количества (400)
+            missing = db.execute(
+                select(Position.id).where(_OWNED_POSITION),
+                {"position_id": sell_data.position_id, "owner_id": user_id}
+            ).first() is None
+        else:
+            if not position["credited"]:
+                raise ValueError("User not found")
+
+            if position["quantity"] == 0:
+                # Если продали все, удаляем позицию
+                db.execute(delete(Position).where(Position.id == position["id"]))
+                result = {"message": "Position sold completely and deleted"}
+            else:
+                result = PositionOut.model_validate(dict(position))
             db.commit()
-            return {"message": "Position sold completely and deleted"}
-        
-        # Обновляем USD баланс пользователя
-        from app.models.user import User
-        user = db.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Рассчитываем сумму полученную от продажи
-        usd_received = sell_data.quantity * (sell_data.sell_price or position.buy_price or Decimal("0"))
-        
-        # Обновляем баланс пользователя
-        if user.usd_balance is None:
-            user.usd_balance = Decimal("0")
-        user.usd_balance += usd_received
-        
-        db.commit()
-        db.refresh(position)
-        return position
-        
+            bump_positions_version(user_id)
+            invalidate_user_cache(user_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to sell position: {str(e)}")
 
+    if missing:
+        raise HTTPException(status_code=404, detail="Position not found")
+    if result is None:
+        raise HTTPException(status_code=400, detail="Insufficient quantity to sell")
+    return result
+
 
 @router.delete("/{position_id}")
 def delete_position(
@@ -437,26 +604,23 @@ def delete_position(
     db: Session = Depends(get_db)
 ):
     """Удалить позицию (requires JWT authentication and user isolation)"""
-    position = db.execute(
-        select(Position).where(
-            and_(
-                Position.id == position_id,
-                Position.user_id == user_id
-            )
-        )
-    ).scalar_one_or_none()
-    
-    if not position:
-        raise HTTPException(status_code=404, detail="Position not found")
-    
     try:
-        db.delete(position)
+        # Проверка владельца и удаление одним запросом
+        deleted_id = db.execute(
+            _DELETE_OWNED_POSITION,
+            {"position_id": position_id, "owner_id": user_id}
+        ).scalar_one_or_none()
         db.commit()
-        return {"message": "Position deleted successfully"}
+        if deleted_id is not None:
+            bump_positions_version(user_id)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to delete position: {str(e)}")
 
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Position not found")
+    return {"message": "Position deleted successfully"}
+
 
 # Старый эндпоинт для совместимости
 @router.post("/add")
@@ -464,37 +628,38 @@ def add_position_legacy(
     symbol: str,
     quantity: float,
     price: float,
+    background_tasks: BackgroundTasks,
     user_id: UUID = Depends(get_user_id_from_request_or_jwt),
     db: Session = Depends(get_db)
 ):
     """Legacy endpoint для создания позиции (requires JWT authentication)"""
     try:
-        position = Position(
+        row = _upsert_lot(
+            db,
             user_id=user_id,
             symbol=symbol.upper().strip(),
             quantity=Decimal(str(quantity)),
             buy_price=Decimal(str(price)),
             currency="USD"
         )
-        
-        db.add(position)
-        db.commit()
-        db.refresh(position)
-        
-        # Автоматически загружаем цену для нового символа
-        try:
-            load_price_for_symbol(symbol.upper().strip(), db)
-            logger.info(f"Auto-loaded price data for legacy position: {symbol}")
-        except Exception as e:
-            logger.warning(f"Failed to auto-load price for {symbol}: {e}")
-            # Не прерываем создание позиции из-за ошибки загрузки цены
-        
-        return {
+        if row is None:
+            raise ValueError(f"Position {symbol} already exists with a different asset class")
+        position, created = row
+
+        result = {
             "id": str(position.id),
             "symbol": position.symbol,
             "quantity": float(position.quantity),
             "buy_price": float(position.buy_price),
         }
+        db.commit()
+        bump_positions_version(user_id)
+        
+        # Автоматически загружаем цену для нового символа после ответа
+        if created:
+            background_tasks.add_task(_auto_load_price, position.symbol, user_id)
+        
+        return result
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to create position: {str(e)}")
\ No newline at end of file
@@ -12,7 +12,7 @@ router = APIRouter(prefix="/prices-eod", tags=["prices-eod"])
 
 
 @router.post("/{symbol}/upsert", response_model=dict)
-async def upsert_prices(
+def upsert_prices(
     symbol: str,
     prices: List[PriceEODCreate],
     db: Session = Depends(get_db)
@@ -46,7 +46,7 @@ async def upsert_prices(
 
 
 @router.get("/{symbol}", response_model=List[PriceEODResponse])
-async def get_prices(
+def get_prices(
     symbol: str,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
@@ -63,7 +63,7 @@ async def get_prices(
 
 
 @router.get("/{symbol}/latest", response_model=PriceEODResponse)
-async def get_latest_price(
+def get_latest_price(
     symbol: str,
     db: Session = Depends(get_db)
 ):
@@ -83,7 +83,7 @@ async def get_latest_price(
 
 
 @router.get("/symbols", response_model=List[str])
-async def get_symbols(
+def get_symbols(
     db: Session = Depends(get_db)
 ):
     """Get all symbols that have price data"""
@@ -96,7 +96,7 @@ async def get_symbols(
 
 
 @router.delete("/{symbol}", response_model=dict)
-async def delete_prices(
+def delete_prices(
     symbol: str,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
@@ -10,6 +10,13 @@ from datetime import datetime
 
 router = APIRouter(prefix="/prices", tags=["prices"])
 
+# Строк на один executemany: большие CSV уходят пакетами, а не по INSERT на строку
+BATCH_SIZE = 5000
+
+_INSERT_PRICE = insert(Price.__table__).on_conflict_do_nothing(
+    index_elements=["symbol", "ts"]
+)
+
 @router.post("/load_csv")
 def load_prices_csv(
     path: str = Query(..., description="Путь к CSV внутри контейнера API, напр. /app/backend/data/prices.csv"),
@@ -21,26 +28,36 @@ def load_prices_csv(
 
     added = 0
     skipped = 0
+    batch = []
     with p.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        # csv.reader + индексы колонок: без словаря на каждую строку, как у DictReader
+        reader = csv.reader(f)
+        header = next(reader, [])
         # ожидаем колонки: symbol, ts, close
+        try:
+            i_symbol, i_ts, i_close = (header.index(name) for name in ("symbol", "ts", "close"))
+        except ValueError:
+            # Без нужных колонок ни одна строка не разбирается
+            skipped = sum(1 for row in reader if row)
+            reader = ()
         for row in reader:
+            if not row:
+                continue
             try:
-                symbol = row["symbol"].strip()
-                ts = datetime.fromisoformat(row["ts"].strip())
-                close = float(row["close"])
+                symbol = row[i_symbol].strip()
+                ts = datetime.fromisoformat(row[i_ts].strip())
+                close = float(row[i_close])
             except Exception as e:
                 skipped += 1
                 continue
 
-            stmt = insert(Price.__table__).values(
-                symbol=symbol,
-                ts=ts,
-                close=close,
-            ).on_conflict_do_nothing(
-                index_elements=["symbol", "ts"]
-            )
-            db.execute(stmt)
-            added += 1
+            batch.append({"symbol": symbol, "ts": ts, "close": close})
+            if len(batch) >= BATCH_SIZE:
+                db.execute(_INSERT_PRICE, batch)
+                added += len(batch)
+                batch = []
+    if batch:
+        db.execute(_INSERT_PRICE, batch)
+        added += len(batch)
     db.commit()
     return {"status": "ok", "added": added, "skipped": skipped}
@@ -4,25 +4,34 @@ API роутер для анализа сентимента финансовых
 """
 
 import logging
-from typing import List, Dict, Any, Optional
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 
 from app.database import get_db
 from app.schemas_sentiment import (
     SentimentRequest, SentimentScoreResponse, PortfolioSentimentMetrics,
-    SentimentGrouping, PositionSentimentData, PositionNewsItem
+    SentimentGrouping, PositionSentimentData, PositionNewsItem, SentimentResult
 )
 from app.services.sentiment_analysis import SentimentAnalysisService
-from app.services.sentiment_cache import SentimentAggregationService
+from app.services.sentiment_cache import SentimentAggregationService, get_sentiment_aggregation_service
+from app.services.price_eod import PriceEODRepository
 from app.models.position import Position
 from app.models.user import User
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/ai/sentiment", tags=["sentiment-analysis"])
+router = APIRouter(prefix="/ai/sentiment", tags=["sentiment-analysis"], default_response_class=ORJSONResponse)
+
+# Валидация списка результатов одним вызовом pydantic-core вместо конструктора на каждый элемент
+_SENTIMENT_RESULTS_ADAPTER = TypeAdapter(List[SentimentResult])
 
 # =============================================================================
 # Внутренние батч-эндпойнты (используются Celery задачами)
@@ -64,7 +73,8 @@ async def score_sentiment_batch(
 async def aggregate_symbol_sentiment(
     symbol: str,
     sentiment_results: List[Dict[str, Any]],
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
 ) -> Dict[str, Any]:
     """
     Агрегация sentiment данных для конкретного символа
@@ -73,25 +83,18 @@ async def aggregate_symbol_sentiment(
     logger.info(f"Aggregating sentiment data for {symbol}")
     
     try:
-        aggregation_service = SentimentAggregationService()
-        
         # Конвертируем JSON в SentimentResult объекты
-        from app.schemas_sentiment import SentimentResult, SentimentLabel
-        
-        results = []
-        for item in sentiment_results:
-            result = SentimentResult(
-                symbol=item['symbol'],
-                sentiment=SentimentLabel(item['sentiment']),
-                confidence=item['confidence'],
-                strength=item['strength'],
-                note=item.get('note')
+        results = _SENTIMENT_RESULTS_ADAPTER.validate_python(sentiment_results)
+        
+        # Агрегируем для 7d и 30d окон. Расчёт чисто CPU - выносим в пул потоков,
+        # чтобы большие пакеты не блокировали event loop
+        def aggregate_windows():
+            return (
+                aggregation_service.aggregate_symbol_sentiment(symbol, results, 7),
+                aggregation_service.aggregate_symbol_sentiment(symbol, results, 30),
             )
-            results.append(result)
         
-        # Агрегируем для 7d и 30d окон
-        sentiment_7d = aggregation_service.aggregate_symbol_sentiment(symbol, results, 7)
-        sentiment_30d = aggregation_service.aggregate_symbol_sentiment(symbol, results, 30)
+        sentiment_7d, sentiment_30d = await run_in_threadpool(aggregate_windows)
         
         # Кэшируем результат
         await aggregation_service.cache_sentiment_data(
@@ -116,11 +119,64 @@ async def aggregate_symbol_sentiment(
 # UI интеграция (для Insights страницы)
 # =============================================================================
 
+def _load_portfolio(db: Session, user_id: UUID) -> Optional[Tuple[list, Dict[str, Any]]]:
+    """
+    Позиции пользователя (symbol, quantity, buy_price) и последние цены их символов.
+    
+    Пользователь и позиции - одним запросом, цены - одним пакетным запросом.
+    None, если пользователя нет.
+    """
+    rows = db.execute(
+        select(Position.symbol, Position.quantity, Position.buy_price)
+        .select_from(User)
+        .outerjoin(Position, Position.user_id == User.id)
+        .where(User.id == user_id)
+    ).all()
+    if not rows:
+        return None
+    
+    positions = [row for row in rows if row.symbol is not None]
+    latest_prices = PriceEODRepository(db).get_latest_prices_bulk(position.symbol for position in positions)
+    return positions, latest_prices
+
+
+def _position_weights(positions: list, latest_prices: Dict[str, Any]) -> Tuple[Dict[str, float], Dict[str, float], float]:
+    """
+    Стоимости и веса (в %) позиций портфеля, вычисленные векторно.
+    
+    Стоимость - quantity * последняя цена, иначе * цена покупки; позиции без цены
+    пропускаются. Возвращает (стоимости, веса, общая стоимость).
+    """
+    symbols = []
+    quantities = []
+    prices = []
+    for position in positions:
+        if not position.symbol:
+            continue
+        latest_price = latest_prices.get(position.symbol)
+        if latest_price:
+            price = latest_price.close
+        elif position.buy_price:
+            # Используем цену покупки если нет текущей цены
+            price = position.buy_price
+        else:
+            continue
+        symbols.append(position.symbol)
+        quantities.append(float(position.quantity))
+        prices.append(float(price))
+    
+    values = np.asarray(quantities, dtype=np.float64) * np.asarray(prices, dtype=np.float64)
+    total_value = float(values.sum())
+    weights = values * (100.0 / total_value) if total_value > 0 else np.zeros_like(values)
+    return dict(zip(symbols, values.tolist())), dict(zip(symbols, weights.tolist())), total_value
+
+
 @router.get("/portfolio/{user_id}", response_model=PortfolioSentimentMetrics)
 async def get_portfolio_sentiment(
     user_id: UUID,
     window_days: int = Query(default=30, ge=7, le=90),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
 ) -> PortfolioSentimentMetrics:
     """
     Получение сентимент метрик для портфеля пользователя
@@ -129,16 +185,12 @@ async def get_portfolio_sentiment(
     logger.info(f"Getting portfolio sentiment for user {user_id}, window: {window_days}d")
     
     try:
-        # Получаем позиции пользователя
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        # Запросы к БД синхронные - выполняем в пуле потоков, не блокируя event loop
+        portfolio = await run_in_threadpool(_load_portfolio, db, user_id)
+        if portfolio is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        positions_query = (
-            db.query(Position)
-            .filter(Position.user_id == user_id)
-            .all()
-        )
+        positions_query, latest_prices = portfolio
         
         if not positions_query:
             # Пустой портфель
@@ -154,55 +206,27 @@ async def get_portfolio_sentiment(
                 weighted_by_position=True
             )
         
-        # Извлекаем веса позиций
-        position_weights = {}
-        total_value = 0.0
-        
-        # Добавляем импорт PriceEODRepository
-        from app.services.price_eod import PriceEODRepository
-        price_repo = PriceEODRepository(db)
-        
-        for position in positions_query:
-            if position.symbol:
-                # Получаем текущую цену
-                latest_price = price_repo.get_latest_price(position.symbol)
-                if latest_price:
-                    current_price = float(latest_price.close)
-                    position_value = float(position.quantity) * current_price
-                    position_weights[position.symbol] = position_value
-                    total_value += position_value
-                elif position.buy_price:
-                    # Используем цену покупки если нет текущей цены
-                    position_value = float(position.quantity) * float(position.buy_price)
-                    position_weights[position.symbol] = position_value
-                    total_value += position_value
-        
-        # Нормализуем веса до 100%
-        if total_value > 0:
-            position_weights = {
-                symbol: weight / total_value * 100 
-                for symbol, weight in position_weights.items()
-            }
+        # Извлекаем веса позиций (нормализованы до 100%)
+        position_values, position_weights, total_value = _position_weights(positions_query, latest_prices)
+        if total_value <= 0:
+            position_weights = position_values
         
         # Получаем sentiment данные из кэша
-        aggregation_service = SentimentAggregationService()
-        
         symbol_sentiment_7d = {}
         symbol_sentiment_30d = {}
         
-        for symbol in position_weights.keys():
-            cached_data = await aggregation_service.get_cached_sentiment(symbol)
-            if cached_data:
-                symbol_sentiment_7d[symbol] = {
-                    'sentiment_score': cached_data.sentiment_score_7d,
-                    'coverage_count': cached_data.coverage_count_7d,
-                    'confidence_avg': cached_data.confidence_avg
-                }
-                symbol_sentiment_30d[symbol] = {
-                    'sentiment_score': cached_data.sentiment_score_30d,
-                    'coverage_count': cached_data.coverage_count_30d,
-                    'confidence_avg': cached_data.confidence_avg
-                }
+        cached_sentiment = await aggregation_service.get_cached_sentiment_bulk(list(position_weights))
+        for symbol, cached_data in cached_sentiment.items():
+            symbol_sentiment_7d[symbol] = {
+                'sentiment_score': cached_data.sentiment_score_7d,
+                'coverage_count': cached_data.coverage_count_7d,
+                'confidence_avg': cached_data.confidence_avg
+            }
+            symbol_sentiment_30d[symbol] = {
+                'sentiment_score': cached_data.sentiment_score_30d,
+                'coverage_count': cached_data.coverage_count_30d,
+                'confidence_avg': cached_data.confidence_avg
+            }
         
         # Вычисляем портфельные метрики
         portfolio_metrics = aggregation_service.calculate_portfolio_sentiment(
@@ -224,7 +248,8 @@ async def get_portfolio_sentiment(
 async def get_sentiment_grouping(
     user_id: UUID,
     timeframe: str = Query(default="30d", regex="^(7d|30d)$"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
 ) -> SentimentGrouping:
     """
     Получение группировки позиций по сентименту
@@ -234,11 +259,7 @@ async def get_sentiment_grouping(
     
     try:
         # Получаем позиции и кэшированные sentiment данные
-        positions_query = (
-            db.query(Position)
-            .filter(Position.user_id == user_id)
-            .all()
-        )
+        positions_query, latest_prices = await run_in_threadpool(_load_portfolio, db, user_id) or ([], {})
         
         if not positions_query:
             return SentimentGrouping(
@@ -248,57 +269,21 @@ async def get_sentiment_grouping(
                 fallback_rate=0.0
             )
         
-        # Добавляем PriceEODRepository для получения цен
-        from app.services.price_eod import PriceEODRepository
-        price_repo = PriceEODRepository(db)
-        
-        # Извлекаем данные позиций
-        position_weights = {}
-        total_value = 0.0
-        
-        for position in positions_query:
-            if position.symbol:
-                # Получаем текущую цену
-                latest_price = price_repo.get_latest_price(position.symbol)
-                if latest_price:
-                    current_price = float(latest_price.close)
-                    position_value = float(position.quantity) * current_price
-                    total_value += position_value
-                elif position.buy_price:
-                    # Используем цену покупки если нет текущей цены
-                    position_value = float(position.quantity) * float(position.buy_price)
-                    total_value += position_value
-        
-        # Вычисляем веса в процентах
-        for position in positions_query:
-            if position.symbol:
-                latest_price = price_repo.get_latest_price(position.symbol)
-                if latest_price:
-                    current_price = float(latest_price.close)
-                    position_value = float(position.quantity) * current_price
-                elif position.buy_price:
-                    position_value = float(position.quantity) * float(position.buy_price)
-                else:
-                    continue
-                    
-                weight_pct = (position_value / total_value * 100) if total_value > 0 else 0
-                position_weights[position.symbol] = weight_pct
+        # Извлекаем данные позиций и веса в процентах
+        _, position_weights, _ = _position_weights(positions_query, latest_prices)
         
         # Получаем sentiment данные
-        aggregation_service = SentimentAggregationService()
+        key = 'sentiment_score_30d' if timeframe == '30d' else 'sentiment_score_7d'
+        coverage_key = 'coverage_count_30d' if timeframe == '30d' else 'coverage_count_7d'
         
         symbol_sentiment_data = {}
-        for symbol in position_weights.keys():
-            cached_data = await aggregation_service.get_cached_sentiment(symbol)
-            if cached_data:
-                key = 'sentiment_score_30d' if timeframe == '30d' else 'sentiment_score_7d'
-                coverage_key = 'coverage_count_30d' if timeframe == '30d' else 'coverage_count_7d'
-                
-                symbol_sentiment_data[symbol] = {
-                    'sentiment_score': getattr(cached_data, key),
-                    'coverage_count': getattr(cached_data, coverage_key),
-                    'confidence_avg': cached_data.confidence_avg
-                }
+        cached_sentiment = await aggregation_service.get_cached_sentiment_bulk(list(position_weights))
+        for symbol, cached_data in cached_sentiment.items():
+            symbol_sentiment_data[symbol] = {
+                'sentiment_score': getattr(cached_data, key),
+                'coverage_count': getattr(cached_data, coverage_key),
+                'confidence_avg': cached_data.confidence_avg
+            }
         
         # Создаем группировку
         grouping = aggregation_service.create_sentiment_grouping(
@@ -318,7 +303,8 @@ async def get_sentiment_grouping(
 async def get_positions_sentiment(
     user_id: UUID,
     top_news_count: int = Query(default=3, ge=1, le=10),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
 ) -> List[PositionSentimentData]:
     """
     Получение sentiment данных для всех позиций пользователя
@@ -327,38 +313,43 @@ async def get_positions_sentiment(
     logger.info(f"Getting positions sentiment for user {user_id}")
     
     try:
-        # Получаем позиции
-        positions_query = (
-            db.query(Position)
-            .filter(Position.user_id == user_id)
-            .all()
+        # Получаем тикеры позиций - только колонку, без ORM-объектов (в пуле потоков - запрос синхронный)
+        positions_query = await run_in_threadpool(
+            lambda: db.execute(select(Position.symbol).where(Position.user_id == user_id)).all()
         )
         
         if not positions_query:
             return []
         
+        # Топ новости - симуляция (обычно тут был бы отдельный запрос): шаблон собираем
+        # один раз на запрос, для позиции только подставляем заголовок
+        now = datetime.utcnow()
+        news_template = [
+            PositionNewsItem(
+                headline="",
+                published_at=now - timedelta(hours=i*6),
+                sentiment="positive" if i % 3 == 0 else "neutral",
+                confidence=0.7 + i * 0.1,
+                source_weight=1.0
+            )
+            for i in range(min(top_news_count, 3))
+        ]
+        
         # Получаем sentiment данные для каждой позиции
-        aggregation_service = SentimentAggregationService()
         position_sentiment_data = []
+        cached_sentiment = await aggregation_service.get_cached_sentiment_bulk(
+            [position.symbol for position in positions_query if position.symbol]
+        )
         
         for position in positions_query:
             if not position.symbol:
                 continue
             
-            cached_data = await aggregation_service.get_cached_sentiment(position.symbol)
+            cached_data = cached_sentiment.get(position.symbol)
             
             if cached_data:
-                # Получаем топ новости (симуляция - обычно тут был бы отдельный запрос)
-                top_news = [
-                  PositionNewsItem(
-                      headline=f"Recent news about {position.symbol}",
-                      published_at=datetime.utcnow() - timedelta(hours=i*6),
-                      sentiment="positive" if i % 3 == 0 else "neutral",
-                      confidence=0.7 + i * 0.1,
-                      source_weight=1.0
-                  )
-                  for i in range(min(top_news_count, 3))
-                ]
+                headline = f"Recent news about {position.symbol}"
+                top_news = [item.model_copy(update={"headline": headline}) for item in news_template]
                 
                 position_data = PositionSentimentData(
                     symbol=position.symbol,
@@ -388,7 +379,7 @@ async def get_positions_sentiment(
                     top_news=[],
                     has_data_gap=True,
                     model_used="none",
-                    last_updated=datetime.utcnow()
+                    last_updated=now
                 )
             
             position_sentiment_data.append(position_data)
@@ -408,14 +399,14 @@ async def get_positions_sentiment(
 
 @router.delete("/cache/{symbol}")
 async def invalidate_sentiment_cache(
-    symbol: str
+    symbol: str,
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
 ) -> Dict[str, str]:
     """
     Инвалидация кэша для конкретного символа (для форс-рефреша)
     """
     
     try:
-        aggregation_service = SentimentAggregationService()
         await aggregation_service.invalidate_cache(symbol)
         
         return {"message": f"Cache invalidated for {symbol}"}
@@ -428,13 +419,14 @@ async def invalidate_sentiment_cache(
         )
 
 @router.delete("/cache")
-async def invalidate_all_sentiment_cache() -> Dict[str, str]:
+async def invalidate_all_sentiment_cache(
+    aggregation_service: SentimentAggregationService = Depends(get_sentiment_aggregation_service)
+) -> Dict[str, str]:
     """
     Полная инвалидация sentiment кэша
     """
     
     try:
-        aggregation_service = SentimentAggregationService()
         await aggregation_service.invalidate_cache()
         
         return {"message": "All sentiment cache invalidated"}
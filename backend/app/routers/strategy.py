@@ -1,6 +1,8 @@
 """Strategy management API endpoints"""
 
 from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from uuid import UUID
 from decimal import Decimal
@@ -9,12 +11,14 @@ from typing import Union
 from app.database import get_db
 from app.models.strategy import Strategy
 from app.models.position import Position
+from app.models.user import User
 from app.crud.strategy import (
     get_by_user_id, 
     upsert_for_user, 
     partial_update_for_user,
     delete_for_user,
     validate_allocation_sum,
+    allocation_total,
     compute_strategy_derived_fields,
     get_all_templates
 )
@@ -34,7 +38,7 @@ except ImportError:
     StrategyEmpty = dict
     StrategyTemplate = dict
 
-router = APIRouter(prefix="/strategy", tags=["strategy"])
+router = APIRouter(prefix="/strategy", tags=["strategy"], default_response_class=ORJSONResponse)
 
 
 def get_current_user_id(request: Request) -> UUID:
@@ -52,25 +56,49 @@ def get_current_user_id(request: Request) -> UUID:
         raise HTTPException(status_code=400, detail="Invalid user ID format")
 
 
+def _strategy_to_out(strategy: Strategy, derived_fields: dict) -> StrategyOut:
+    """Build StrategyOut from a DB row plus the computed fields (shared by GET/PUT/PATCH)"""
+    return StrategyOut(
+        id=strategy.id,
+        user_id=strategy.user_id,
+        base_currency=strategy.base_currency,
+        target_value=strategy.target_value,
+        target_date=strategy.target_date,
+        risk_level=strategy.risk_level,
+        expected_return=strategy.expected_return,
+        volatility=strategy.volatility,
+        max_drawdown=strategy.max_drawdown,
+        monthly_contribution=strategy.monthly_contribution,
+        rebalancing_frequency=strategy.rebalancing_frequency,
+        allocation=strategy.allocation or {},
+        constraints=strategy.constraints or {},
+        created_at=int(strategy.created_at),
+        updated_at=int(strategy.updated_at),
+        **derived_fields
+    )
+
+
 async def get_current_portfolio_value(user_id: UUID, db: Session) -> Decimal:
     """
     Calculate current portfolio value for a user.
     Includes positions value + cash balance.
     """
-    # Calculate positions value
-    positions = db.execute(Position.__table__.select().where(Position.user_id == user_id)).fetchall()
-    total_positions_value = Decimal("0")
-    
-    for position in positions:
-        position_value = Decimal(str(position.quantity)) * Decimal(str(position.last if position.last else position.buy_price or 0))
-        total_positions_value += position_value
+    # Positions value (at buy price - positions carry no last price) and cash balance
+    # as two scalar subqueries of one statement: a single round-trip
+    positions_value = (
+        select(func.coalesce(func.sum(Position.quantity * func.coalesce(Position.buy_price, 0)), 0))
+        .where(Position.user_id == user_id)
+        .scalar_subquery()
+    )
+    cash_balance = select(User.usd_balance).where(User.id == user_id).scalar_subquery()
+    row = db.execute(
+        select(positions_value.label("positions_value"), cash_balance.label("cash_balance"))
+    ).one()
     
-    # Get user cash balance  
-    from app.models.user import User
-    user = db.execute(User.__table__.select().where(User.id == user_id)).first()
-    cash_balance = Decimal(str(user.usd_balance)) if user else Decimal("0")
+    total_positions_value = Decimal(str(row.positions_value))
+    cash = Decimal(str(row.cash_balance)) if row.cash_balance is not None else Decimal("0")
     
-    return total_positions_value + cash_balance
+    return total_positions_value + cash
 
 
 @router.get("", response_model=Union[StrategyOut, StrategyEmpty])
@@ -99,26 +127,7 @@ def get_strategy(
         derived_fields = compute_strategy_derived_fields(strategy, Decimal(str(portfolio_value)))
         
         # Create response with derived fields
-        strategy_dict = {
-            "id": strategy.id,
-            "user_id": strategy.user_id,
-            "base_currency": strategy.base_currency,
-            "target_value": strategy.target_value,
-            "target_date": strategy.target_date,
-            "risk_level": strategy.risk_level,
-            "expected_return": strategy.expected_return,
-            "volatility": strategy.volatility,
-            "max_drawdown": strategy.max_drawdown,
-            "monthly_contribution": strategy.monthly_contribution,
-            "rebalancing_frequency": strategy.rebalancing_frequency,
-            "allocation": strategy.allocation or {},
-            "constraints": strategy.constraints or {},
-            "created_at": int(strategy.created_at),
-            "updated_at": int(strategy.updated_at),
-            **derived_fields
-        }
-        
-        return StrategyOut(**strategy_dict)
+        return _strategy_to_out(strategy, derived_fields)
         
     except HTTPException:
         raise
@@ -156,26 +165,7 @@ def upsert_strategy(
         portfolio_value = 0  # Simplified for now
         derived_fields = compute_strategy_derived_fields(strategy, Decimal(str(portfolio_value)))
         
-        strategy_dict = {
-            "id": strategy.id,
-            "user_id": strategy.user_id,
-            "base_currency": strategy.base_currency,
-            "target_value": strategy.target_value,
-            "target_date": strategy.target_date,
-            "risk_level": strategy.risk_level,
-            "expected_return": strategy.expected_return,
-            "volatility": strategy.volatility,
-            "max_drawdown": strategy.max_drawdown,
-            "monthly_contribution": strategy.monthly_contribution,
-            "rebalancing_frequency": strategy.rebalancing_frequency,
-            "allocation": strategy.allocation or {},
-            "constraints": strategy.constraints or {},
-            "created_at": int(strategy.created_at),
-            "updated_at": int(strategy.updated_at),
-            **derived_fields
-        }
-        
-        return StrategyOut(**strategy_dict)
+        return _strategy_to_out(strategy, derived_fields)
         
     except HTTPException:
         raise
@@ -220,26 +210,7 @@ def partial_update_strategy(
         portfolio_value = 0  # Simplified for now
         derived_fields = compute_strategy_derived_fields(strategy, Decimal(str(portfolio_value)))
         
-        strategy_dict = {
-            "id": strategy.id,
-            "user_id": strategy.user_id,
-            "base_currency": strategy.base_currency,
-            "target_value": strategy.target_value,
-            "target_date": strategy.target_date,
-            "risk_level": strategy.risk_level,
-            "expected_return": strategy.expected_return,
-            "volatility": strategy.volatility,
-            "max_drawdown": strategy.max_drawdown,
-            "monthly_contribution": strategy.monthly_contribution,
-            "rebalancing_frequency": strategy.rebalancing_frequency,
-            "allocation": strategy.allocation or {},
-            "constraints": strategy.constraints or {},
-            "created_at": int(strategy.created_at),
-            "updated_at": int(strategy.updated_at),
-            **derived_fields
-        }
-        
-        return StrategyOut(**strategy_dict)
+        return _strategy_to_out(strategy, derived_fields)
         
     except HTTPException:
         raise
@@ -295,17 +266,16 @@ def validate_allocation_only(
         raise HTTPException(status_code=400, detail="Allocation data required")
     
     try:
-        is_valid = validate_allocation_sum(allocation)
+        total = allocation_total(allocation)
+        is_valid = validate_allocation_sum(allocation, total)
         
         if is_valid:
-            total = sum(float(val) for val in allocation.values() if isinstance(val, (int, float, str)))
             return {
                 "valid": True,
                 "total_percentage": round(total, 2),
                 "message": f"Valid allocation totaling {total:.1f}%"
             }
         else:
-            total = sum(float(val) for val in allocation.values() if isinstance(val, (int, float, str)))
             return {
                 "valid": False,
                 "total_percentage": round(total, 2),
@@ -1,129 +1,172 @@
 from __future__ import annotations
+import asyncio
+import io
+import logging
+import os
+import re
 import time
+from bisect import bisect_left, bisect_right
 from typing import List, Optional
 from fastapi import APIRouter, Query
-from urllib.request import urlopen
+
+import httpx
+import pandas as pd
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
 
 # Официальные справочники тикеров (обновляются в течение дня)
 NASDAQ_LISTED_URL = "https://www.nasdaqtrader.com/dynamic/symdir/nasdaqlisted.txt"
 OTHER_LISTED_URL  = "https://www.nasdaqtrader.com/dynamic/symdir/otherlisted.txt"
 
 # Простой in-memory кэш
-_CACHE = {"ts": 0.0, "symbols": []}  # symbols: List[str] (UPPERCASE)
-_SYMBOL_INDEX = {}  # Индекс для быстрого поиска: {prefix: [symbols]}
+# symbols: отсортированный List[str] (UPPERCASE) - префиксы ищем бинарным поиском;
+# blob: те же тикеры через "\n" - для поиска подстроки одним регулярным выражением
+_CACHE = {"ts": 0.0, "symbols": [], "blob": ""}
 TTL_SECONDS = 6 * 3600  # обновляем раз в 6 часов
+RETRY_SECONDS = 5 * 60  # повтор после неудачной загрузки
+FETCH_TIMEOUT = 15
+
+# Спец-символы, с которыми тикер не берём в справочник
+_BAD_CHARS_PATTERN = r"[\^ /]"
+
+# Якоря для /popular: кортеж собирается один раз при импорте
+_ANCHORS: tuple[str, ...] = (
+    "SPY", "AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "QQQ", "BRK.B",
+    "V", "XOM", "UNH", "JNJ", "PG", "JPM", "HD", "MA", "NFLX", "AMD",
+)
 
 router = APIRouter(prefix="/symbols/external", tags=["symbols-external"])
 
-def _fetch_txt(url: str, timeout: int = 15) -> str:
-    with urlopen(url, timeout=timeout) as resp:
-        return resp.read().decode("utf-8", errors="replace")
-
-def _parse_pipe_table(text: str, cols_expect_min: int = 2) -> List[List[str]]:
-    rows: List[List[str]] = []
-    for line in text.splitlines():
-        line = line.strip()
-        if not line or line.startswith("File Creation Time"):  # хвостовая строка с метаданными
-            continue
-        parts = line.split("|")
-        if len(parts) >= cols_expect_min:
-            rows.append(parts)
-    return rows
-
-def _load_us_symbols() -> List[str]:
+async def _fetch_bytes(client: httpx.AsyncClient, url: str) -> bytes:
+    resp = await client.get(url)
+    resp.raise_for_status()
+    return resp.content
+
+def _listed_symbols(data: bytes, symbol_col: str, test_issue_col: str) -> pd.Series:
+    """Тикеры таблицы в UPPERCASE, без тестовых и без спец-символов (^, пробел, /)"""
+    # pandas (C-парсер) читает байты как есть - без копии в str - и только две нужные колонки
+    df = pd.read_csv(
+        io.BytesIO(data), sep="|", dtype=str, na_filter=False, on_bad_lines="skip",
+        usecols=[symbol_col, test_issue_col], encoding="utf-8", encoding_errors="replace",
+    )
+    # хвостовая строка с метаданными
+    df = df[~df[symbol_col].str.startswith("File Creation Time")]
+    syms = df[symbol_col].str.strip().str.upper()
+    mask = (
+        syms.ne("")
+        & df[test_issue_col].str.strip().str.upper().ne("Y")
+        & ~syms.str.contains(_BAD_CHARS_PATTERN, regex=True)
+    )
+    return syms[mask]
+
+def _parse_us_symbols(nasdaq_data: bytes, other_data: bytes) -> List[str]:
     """
     Возвращает UPPERCASE тикеры США (NASDAQ, NYSE/AMEX и др.), без тестовых,
     без спец-символов. Источник: NasdaqTrader.
     """
     # nasdaqlisted.txt: Symbol|Security Name|Market Category|Test Issue|Financial Status|Round Lot Size|ETF|NextShares
-    nasdaq = _parse_pipe_table(_fetch_txt(NASDAQ_LISTED_URL))
     # otherlisted.txt: ACT Symbol|Security Name|Exchange|CQS Symbol|ETF|Round Lot Size|Test Issue|NASDAQ Symbol
-    other  = _parse_pipe_table(_fetch_txt(OTHER_LISTED_URL))
-
-    syms: set[str] = set()
-    # NASDAQ
-    for parts in nasdaq[1:]:  # пропускаем заголовок
-        try:
-            sym, test_issue = parts[0].strip().upper(), parts[3].strip().upper()
-            if not sym or test_issue == "Y":
-                continue
-            if any(c in sym for c in ["^", " ", "/"]):
-                continue
-            syms.add(sym)
-        except Exception:
-            continue
-
-    # OTHER (NYSE, AMEX и т.д.)
-    for parts in other[1:]:
-        try:
-            sym, test_issue = parts[0].strip().upper(), parts[6].strip().upper()
-            if not sym or test_issue == "Y":
-                continue
-            if any(c in sym for c in ["^", " ", "/"]):
-                continue
-            syms.add(sym)
-        except Exception:
-            continue
+    # NASDAQ + OTHER (NYSE, AMEX и т.д.)
+    syms = set(pd.concat([
+        _listed_symbols(nasdaq_data, "Symbol", "Test Issue"),
+        _listed_symbols(other_data, "ACT Symbol", "Test Issue"),
+    ]))
 
     # Немного нормализаций под Stooq: точки (BRK.B) допустимы; оставляем
     return sorted(syms)
 
-def _build_symbol_index(symbols: List[str]) -> dict:
-    """Создает индекс для быстрого поиска по префиксам"""
-    index = {}
-    for symbol in symbols:
-        # Добавляем все префиксы от 1 до длины символа
-        for i in range(1, len(symbol) + 1):
-            prefix = symbol[:i]
-            if prefix not in index:
-                index[prefix] = []
-            index[prefix].append(symbol)
-    
-    # Сортируем каждый список для консистентности
-    for prefix in index:
-        index[prefix].sort()
-    
-    return index
+def _store_symbols(symbols: List[str]) -> None:
+    _CACHE["symbols"] = sorted(symbols)
+    _CACHE["blob"] = "\n".join(_CACHE["symbols"])
+
+async def _load_us_symbols() -> List[str]:
+    # Оба файла качаем параллельно, разбор - в пуле потоков
+    async with httpx.AsyncClient(timeout=FETCH_TIMEOUT) as client:
+        nasdaq_data, other_data = await asyncio.gather(
+            _fetch_bytes(client, NASDAQ_LISTED_URL),
+            _fetch_bytes(client, OTHER_LISTED_URL),
+        )
+    return await asyncio.to_thread(_parse_us_symbols, nasdaq_data, other_data)
+
+def _load_from_disk_if_fresh() -> bool:
+    """Поднимает список с диска, если файл моложе TTL (общий для воркеров и рестартов)"""
+    path = settings.symbols_cache_path
+    try:
+        mtime = os.path.getmtime(path)
+        if time.time() - mtime > TTL_SECONDS:
+            return False
+        with open(path, "r", encoding="utf-8") as f:
+            symbols = [line for line in f.read().split("\n") if line]
+    except Exception:
+        return False
+    if not symbols:
+        return False
+    _store_symbols(symbols)
+    _CACHE["ts"] = mtime
+    return True
+
+def _save_to_disk(symbols: List[str]) -> None:
+    path = settings.symbols_cache_path
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Обычный текст, тикер на строку: читается без десериализации объектов
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(symbols))
+        os.replace(tmp_path, path)  # атомарно: читатели не увидят недописанный файл
+    except Exception as e:
+        logger.warning(f"Failed to persist symbol list to {path}: {e}")
+
+async def refresh_symbols_loop() -> None:
+    """
+    Фоновое обновление списка тикеров (запускается на startup).
+    Запросы к /search никогда не ждут загрузку с NasdaqTrader.
+    """
+    while True:
+        delay = TTL_SECONDS
+        if not _load_from_disk_if_fresh():
+            try:
+                symbols = await _load_us_symbols()
+                _store_symbols(symbols)
+                _CACHE["ts"] = time.time()
+                await asyncio.to_thread(_save_to_disk, symbols)
+            except Exception as e:
+                logger.warning(f"Failed to refresh NasdaqTrader symbols: {e}")
+                delay = RETRY_SECONDS
+        else:
+            delay = max(TTL_SECONDS - (time.time() - _CACHE["ts"]), 1)
+        await asyncio.sleep(delay)
 
 def _ensure_cache() -> List[str]:
-    global _SYMBOL_INDEX
-    now = time.time()
-    if now - _CACHE["ts"] > TTL_SECONDS or not _CACHE["symbols"]:
-        try:
-            _CACHE["symbols"] = _load_us_symbols()
-            _CACHE["ts"] = now
-            # Перестраиваем индекс при обновлении кэша
-            _SYMBOL_INDEX = _build_symbol_index(_CACHE["symbols"])
-        except Exception as e:
-            # Если не удалось загрузить, используем популярные символы как fallback
-            if not _CACHE["symbols"]:
-                _CACHE["symbols"] = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA", "META", "NVDA", "NFLX", "AMD", "INTC"]
-                _SYMBOL_INDEX = _build_symbol_index(_CACHE["symbols"])
+    # Список обновляет refresh_symbols_loop; пока его нет - популярные символы как fallback
+    if not _CACHE["symbols"]:
+        _store_symbols(["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA", "META", "NVDA", "NFLX", "AMD", "INTC"])
     return _CACHE["symbols"]
 
 @router.get("/search", response_model=List[str])
 def search(q: str = Query(..., min_length=1), limit: int = Query(25, ge=1, le=200)) -> List[str]:
     """
-    Быстрый поиск по списку тикеров из NasdaqTrader (кэш 6ч + индекс).
+    Быстрый поиск по списку тикеров из NasdaqTrader (фоновое обновление раз в 6ч + бинарный поиск по префиксу).
     Возвращаем UPPERCASE; при использовании со Stooq можно добавлять суффикс .US.
     """
     q_up = q.strip().upper()
     if not q_up:
         return []
     
-    # Убеждаемся, что кэш и индекс загружены
-    _ensure_cache()
+    # Убеждаемся, что кэш загружен
+    syms = _ensure_cache()
     
-    # Быстрый поиск через индекс
-    if q_up in _SYMBOL_INDEX:
-        return _SYMBOL_INDEX[q_up][:limit]
+    # Тикеры с префиксом q_up - непрерывный диапазон отсортированного списка
+    lo = bisect_left(syms, q_up)
+    hi = bisect_right(syms, q_up + "\uffff", lo)
+    if lo < hi:
+        return syms[lo:min(hi, lo + limit)]
     
     # Если точного префикса нет, ищем частичные совпадения
-    syms = _CACHE["symbols"]
-    starts = [s for s in syms if s.startswith(q_up)]
-    contains = [s for s in syms if q_up in s and s not in starts]
-    out = (starts + contains)[:limit]
-    return out
+    pattern = re.compile(rf"^[^\n]*{re.escape(q_up)}[^\n]*$", re.M)
+    return [m.group() for _, m in zip(range(limit), pattern.finditer(_CACHE["blob"]))]
 
 @router.get("/popular", response_model=List[str])
 def popular(limit: int = Query(20, ge=1, le=200)) -> List[str]:
@@ -131,8 +174,7 @@ def popular(limit: int = Query(20, ge=1, le=200)) -> List[str]:
     Простая "популярность" по эвристике: топ по алфавиту из набора якорей.
     Если нужно умнее — подключим собственную статистику просмотров/частоты в БД.
     """
-    anchors = ["SPY","AAPL","MSFT","NVDA","AMZN","GOOGL","META","TSLA","QQQ","BRK.B","V","XOM","UNH","JNJ","PG","JPM","HD","MA","NFLX","AMD"]
-    return anchors[:limit]
+    return list(_ANCHORS[:limit])
 
 
 
@@ -1,17 +1,48 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from sqlalchemy.orm import Session
+import logging
+from fastapi import APIRouter, Depends, Request, Response, HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session, aliased
+import numpy as np
 from app.database import get_db
+from app.core.auth_middleware import get_session_user_id, require_session_user_id
 from app.models.user import User
-from app.models.position import Position
+from app.models.position import AssetClass, Position
+from app.models.price_eod import PriceEOD
 from app.security import hash_password, verify_password
-from sqlalchemy import select, insert, update, func, and_
-from uuid import uuid4
-from pydantic import BaseModel
+from sqlalchemy import bindparam, exists, literal, select, update, func, and_
+from sqlalchemy.dialects.postgresql import insert
+from uuid import UUID, uuid4
+from pydantic import BaseModel, TypeAdapter
+from datetime import datetime
 from decimal import Decimal
-from typing import List
+from typing import List, Optional
 from app.schemas import CashLedgerMetric
+from app.services.positions_cache import bump_positions_version
+from app.services.price_eod import eod_price_id
+from app.services.ranking_cache import cache_ranking, get_cached_ranking
+from app.services.user_cache import get_user_cached, invalidate_user_cache
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
+
+# Запросы строятся один раз при импорте модуля, значения передаются через bindparam
+_USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+_FIRST_USER = select(User).limit(1)
+# Только колонки, которые отдает /profile, без ORM-объектов Position
+_PROFILE_POSITIONS = select(
+    Position.id,
+    Position.symbol,
+    Position.quantity,
+    Position.buy_price,
+    Position.buy_date,
+    Position.currency,
+    Position.account,
+).where(Position.user_id == bindparam("user_id"))
+
+
+def _start_session(request: Request, user_id, email: str, name: Optional[str]) -> None:
+    """Сохранить пользователя в сессии: /me отдает email и name из cookie"""
+    request.session.update({"user_id": str(user_id), "email": email, "name": name})
 
 # Pydantic models for JSON requests
 class RegisterRequest(BaseModel):
@@ -33,16 +64,23 @@ class UserRanking(BaseModel):
     pnl_percentage: float
     rank: int
 
+# Весь рейтинг сериализуется одним проходом pydantic-core, без валидации каждого элемента в FastAPI
+_RANKING_ADAPTER = TypeAdapter(List[UserRanking])
+
 @router.post("/register")
 def register(request: Request, db: Session = Depends(get_db), email: str = "", name: str = ""):
     """Legacy query parameter endpoint for backward compatibility"""
-    existing = db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-    if existing:
+    # Уникальность email проверяет индекс ix_users_email: один INSERT без гонки SELECT -> INSERT
+    uid = db.execute(
+        insert(User)
+        .values(id=uuid4(), email=email, name=name)
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User.id)
+    ).scalar_one_or_none()
+    if uid is None:
         return {"error": "User already exists"}
-    uid = uuid4()
-    db.execute(insert(User).values(id=uid, email=email, name=name))
     db.commit()
-    request.session["user_id"] = str(uid)
+    _start_session(request, uid, email, name)
     return {"user_id": str(uid), "email": email, "name": name}
 
 @router.post("/register-json", response_model=dict)
@@ -54,52 +92,44 @@ def register_json(register_data: RegisterRequest, request: Request, db: Session
     if len(register_data.password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
     
-    existing = db.execute(select(User).where(User.email == register_data.email)).scalar_one_or_none()
-    
-    if existing:
-        # Migration case: user exists but no password_hash
-        if existing.password_hash is None:
-            hashed_password = hash_password(register_data.password)
-            db.execute(
-                update(User)
-                .where(User.id == existing.id)
-                .values(password_hash=hashed_password, name=register_data.name)
-            )
-            db.commit()
-            request.session["user_id"] = str(existing.id)
-            return {"user_id": str(existing.id), "email": existing.email, "name": register_data.name}
-        else:
-            # User exists with password
-            raise HTTPException(status_code=409, detail="User exists")
-    else:
-        # Create new user
-        uid = uuid4()
-        hashed_password = hash_password(register_data.password)
-        db.execute(
-            insert(User).values(
-                id=uid, 
-                email=register_data.email, 
-                name=register_data.name,
-                password_hash=hashed_password
-            )
+    # Новый пользователь или migration case (пользователь есть, но без password_hash) - одним
+    # INSERT ... ON CONFLICT (email) DO UPDATE; пользователь с паролем не обновляется и не возвращается
+    stmt = insert(User).values(
+        id=uuid4(),
+        email=register_data.email,
+        name=register_data.name,
+        password_hash=hash_password(register_data.password),
+    )
+    uid = db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[User.email],
+            set_={"password_hash": stmt.excluded.password_hash, "name": stmt.excluded.name},
+            where=User.password_hash.is_(None),
         )
-        db.commit()
-        request.session["user_id"] = str(uid)
-        return {"user_id": str(uid), "email": register_data.email, "name": register_data.name}
+        .returning(User.id)
+    ).scalar_one_or_none()
+    if uid is None:
+        # User exists with password
+        raise HTTPException(status_code=409, detail="User exists")
+    db.commit()
+    # В migration case имя изменилось
+    invalidate_user_cache(uid)
+    _start_session(request, uid, register_data.email, register_data.name)
+    return {"user_id": str(uid), "email": register_data.email, "name": register_data.name}
 
 @router.post("/login")
 def login(request: Request, db: Session = Depends(get_db), email: str = ""):
     """Legacy query parameter endpoint for backward compatibility"""
-    user = db.execute(select(User).where(User.email == email)).scalar_one_or_none()
+    user = db.execute(_USER_BY_EMAIL, {"email": email}).scalar_one_or_none()
     if not user:
         return {"error": "User not found"}
-    request.session["user_id"] = str(user.id)
+    _start_session(request, user.id, user.email, user.name)
     return {"user_id": str(user.id), "email": user.email, "name": user.name}
 
 @router.post("/login-json", response_model=dict)
 def login_json(login_data: LoginRequest, request: Request, db: Session = Depends(get_db)):
     """JSON endpoint for user login with password"""
-    user = db.execute(select(User).where(User.email == login_data.email)).scalar_one_or_none()
+    user = db.execute(_USER_BY_EMAIL, {"email": login_data.email}).scalar_one_or_none()
     
     if not user or not user.password_hash:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -107,7 +137,7 @@ def login_json(login_data: LoginRequest, request: Request, db: Session = Depends
     if not verify_password(login_data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    request.session["user_id"] = str(user.id)
+    _start_session(request, user.id, user.email, user.name)
     return {"user_id": str(user.id), "email": user.email, "name": user.name}
 
 @router.post("/logout")
@@ -116,65 +146,84 @@ def logout(request: Request):
     return {"ok": True}
 
 @router.get("/me")
-def me(request: Request, db: Session = Depends(get_db)):
-    uid = request.session.get("user_id")
-    if not uid:
+def me(request: Request, user_id: Optional[UUID] = Depends(get_session_user_id), db: Session = Depends(get_db)):
+    if not user_id:
         return {"authenticated": False}
-    user = db.get(User, uid)
+    # Пользователь мог быть удален: проверяем по кэшу (Redis, без запроса к БД при попадании)
+    user = get_user_cached(db, user_id)
     if not user:
+        request.session.clear()
         return {"authenticated": False}
+    # email и name записаны в сессию при входе/регистрации; сессии, созданные до этого, - из кэша
+    if "email" in request.session:
+        return {
+            "authenticated": True,
+            "user_id": str(user_id),
+            "email": request.session["email"],
+            "name": request.session.get("name"),
+        }
     return {
         "authenticated": True,
-        "user_id": str(user.id),
-        "email": user.email,
-        "name": user.name,
+        "user_id": user["id"],
+        "email": user["email"],
+        "name": user["name"],
     }
 
 @router.get("/ranking", response_model=List[UserRanking])
 def get_user_ranking(db: Session = Depends(get_db)):
     """Получить рейтинг пользователей по PnL (%)"""
     
-    # Получаем всех пользователей с их позициями
-    users_with_positions = db.execute(
-        select(User, Position)
+    # Рейтинг меняется медленно - отдаем из кэша, пока не истек TTL или не изменились позиции
+    cached = get_cached_ranking()
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # Инвестиции и текущую стоимость по пользователям считаем в БД: одна строка на пользователя
+    # с позициями. Текущая цена - последняя EOD цена (кроме крипто), без нее - цена покупки
+    latest = aliased(PriceEOD)
+    buy_price = func.coalesce(Position.buy_price, 0)
+    totals_by_user = db.execute(
+        select(
+            User.id,
+            User.name,
+            User.email,
+            func.sum(Position.quantity * buy_price).label("total_invested"),
+            func.sum(Position.quantity * func.coalesce(latest.close, buy_price)).label("total_value"),
+        )
         .join(Position, User.id == Position.user_id)
+        .outerjoin(latest, and_(
+            Position.asset_class != AssetClass.CRYPTO,
+            latest.id == eod_price_id(),
+        ))
         .where(Position.symbol != "USD")  # Исключаем USD из расчета
+        .group_by(User.id, User.name, User.email)
     ).all()
     
-    # Группируем по пользователям
-    user_portfolios = {}
-    for user, position in users_with_positions:
-        if user.id not in user_portfolios:
-            user_portfolios[user.id] = {
-                "user": user,
-                "positions": []
-            }
-        user_portfolios[user.id]["positions"].append(position)
+    # Рассчитываем метрики сразу для всех пользователей
+    total_invested = np.fromiter(
+        (user.total_invested for user in totals_by_user), dtype=np.float64, count=len(totals_by_user)
+    )
+    total_value = np.fromiter(
+        (user.total_value for user in totals_by_user), dtype=np.float64, count=len(totals_by_user)
+    )
+    pnl_abs = total_value - total_invested
+    # PnL % от инвестиций; без инвестиций (нет цен покупки) - 0
+    pnl_percentage = np.divide(
+        pnl_abs * 100, total_invested, out=np.zeros_like(pnl_abs), where=total_invested != 0
+    )
     
-    # Рассчитываем метрики для каждого пользователя
     rankings = []
-    for user_id, portfolio in user_portfolios.items():
-        user = portfolio["user"]
-        positions = portfolio["positions"]
-        
-        # Рассчитываем общую стоимость и инвестиции
-        total_invested = sum(float(pos.quantity * (pos.buy_price or 0)) for pos in positions)
-        total_value = sum(float(pos.quantity * (pos.buy_price or 0)) for pos in positions)  # Используем buy_price как текущую цену для демо
-        
-        # Добавляем случайный PnL для демо (от -30% до +50%)
-        import random
-        pnl_percentage = random.uniform(-30, 50)
-        pnl_abs = total_invested * (pnl_percentage / 100)
-        total_value = total_invested + pnl_abs
-        
+    for user, user_invested, user_pnl_percentage, user_pnl_abs, user_total_value in zip(
+        totals_by_user, total_invested.tolist(), pnl_percentage.tolist(), pnl_abs.tolist(), total_value.tolist()
+    ):
         rankings.append(UserRanking(
             user_id=str(user.id),
             name=user.name or "Unknown User",
             email=user.email or "unknown@example.com",
-            total_value=total_value,
-            total_invested=total_invested,
-            pnl_abs=pnl_abs,
-            pnl_percentage=pnl_percentage,
+            total_value=user_total_value,
+            total_invested=user_invested,
+            pnl_abs=user_pnl_abs,
+            pnl_percentage=user_pnl_percentage,
             rank=0  # Будет установлен после сортировки
         ))
     
@@ -185,19 +234,21 @@ def get_user_ranking(db: Session = Depends(get_db)):
     for i, ranking in enumerate(rankings):
         ranking.rank = i + 1
     
-    return rankings
+    payload = _RANKING_ADAPTER.dump_json(rankings)
+    cache_ranking(payload)
+    return Response(content=payload, media_type="application/json")
 
 
 @router.get("/balance")
 def get_balance(request: Request, db: Session = Depends(get_db)):
     """Получить текущий USD баланс пользователя"""
     # Временная заглушка - всегда используем первого пользователя для тестирования
-    first_user = db.execute(select(User).limit(1)).scalar_one_or_none()
+    first_user = db.execute(_FIRST_USER).scalar_one_or_none()
     if not first_user:
         raise HTTPException(status_code=404, detail="No users found")
     
     balance = float(first_user.usd_balance or 0)
-    print(f"DEBUG: User {first_user.email} balance: {balance}")  # Debug log
+    logger.debug("User %s balance: %s", first_user.email, balance)
     
     return {"usd_balance": balance}
 
@@ -205,80 +256,94 @@ def get_balance(request: Request, db: Session = Depends(get_db)):
 @router.put("/balance", response_model=dict)
 def update_balance(
     balance_data: dict,
-    request: Request, 
+    user_id: Optional[UUID] = Depends(get_session_user_id),
     db: Session = Depends(get_db)
 ):
     """Обновить USD баланс пользователя и соответствующую USD позицию"""
-    uid = request.session.get("user_id")
-    if not uid:
-        # Временная заглушка - используем первого пользователя для тестирования
-        first_user = db.execute(select(User).limit(1)).scalar_one_or_none()
-        if not first_user:
-            raise HTTPException(status_code=404, detail="No users found")
-        user = first_user
-    else:
-        user = db.execute(select(User).where(User.id == uid)).scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-    
     new_balance = balance_data.get("usd_balance", 0)
     if new_balance < 0:
         raise HTTPException(status_code=400, detail="Balance cannot be negative")
+    balance = literal(Decimal(str(new_balance)), User.usd_balance.type)
     
-    old_balance = user.usd_balance or Decimal("0")
-    user.usd_balance = Decimal(str(new_balance))
+    if not user_id:
+        # Временная заглушка - используем первого пользователя для тестирования
+        user_filter = User.id == select(User.id).limit(1).scalar_subquery()
+    else:
+        user_filter = User.id == user_id
     
-    # Обновляем или создаем USD позицию в таблице positions
-    usd_position = db.execute(
-        select(Position).where(
-            and_(
-                Position.user_id == user.id,
-                Position.symbol == "USD"
-            )
+    # Один запрос: новый баланс пользователя (UPDATE users в CTE), по его результату -
+    # обновление существующей USD позиции или вставка новой, если ее нет.
+    # Нет строки - нет пользователя
+    updated_user = (
+        update(User)
+        .where(user_filter)
+        .values(usd_balance=balance)
+        .returning(User.id)
+        .cte("updated_user")
+    )
+    updated_usd = (
+        update(Position)
+        .where(Position.user_id.in_(select(updated_user.c.id)), Position.symbol == "USD")
+        .values(quantity=balance)
+        .returning(Position.id)
+        .cte("updated_usd")
+    )
+    new_usd = insert(Position).from_select(
+        ["id", "user_id", "symbol", "quantity", "buy_price", "currency", "account", "date_added", "asset_class"],
+        select(
+            literal(uuid4(), Position.id.type),
+            updated_user.c.id,
+            literal("USD"),
+            balance,
+            literal(Decimal("1.0"), Position.buy_price.type),
+            literal("USD"),
+            literal("cash_account"),
+            literal(datetime.utcnow(), Position.date_added.type),
+            # Python-default колонки внутри CTE не заполняются - задаем явно
+            literal(AssetClass.EQUITY, Position.asset_class.type),
+        ).where(~exists(select(updated_usd.c.id))),
+    )
+    # Параллельный запрос мог успеть вставить USD позицию - тогда обновляем ее
+    new_usd = (
+        new_usd.on_conflict_do_update(
+            index_elements=[Position.user_id, Position.symbol, Position.account],
+            set_={"quantity": new_usd.excluded.quantity},
         )
+        .returning(Position.id)
+        .cte("new_usd")
+    )
+    updated_user_id = db.execute(
+        select(updated_user.c.id, select(func.count()).select_from(new_usd).scalar_subquery())
     ).scalar_one_or_none()
-    
-    if usd_position:
-        # Обновляем существующую USD позицию
-        usd_position.quantity = Decimal(str(new_balance))
-    else:
-        # Создаем новую USD позицию
-        usd_position = Position(
-            user_id=user.id,
-            symbol="USD",
-            quantity=Decimal(str(new_balance)),
-            buy_price=Decimal("1.0"),
-            currency="USD",
-            account="cash_account"
-        )
-        db.add(usd_position)
+    if updated_user_id is None:
+        raise HTTPException(status_code=404, detail="User not found" if user_id else "No users found")
     
     db.commit()
+    invalidate_user_cache(updated_user_id)
+    # USD позиция изменилась - кэш GET /positions этого пользователя устарел
+    bump_positions_version(updated_user_id)
     
-    return {"usd_balance": float(user.usd_balance)}
+    return {"usd_balance": float(Decimal(str(new_balance)))}
 
 
 @router.get("/profile", response_model=dict)
-def get_user_profile(request: Request, db: Session = Depends(get_db)):
+def get_user_profile(
+    user_id: UUID = Depends(require_session_user_id),
+    db: Session = Depends(get_db)
+):
     """Получить профиль пользователя с балансом и позициями"""
-    uid = request.session.get("user_id")
-    if not uid:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    user = db.execute(select(User).where(User.id == uid)).scalar_one_or_none()
+    user = get_user_cached(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Получаем позиции пользователя
-    positions = db.execute(
-        select(Position).where(Position.user_id == uid)
-    ).scalars().all()
+    positions = db.execute(_PROFILE_POSITIONS, {"user_id": user_id}).all()
     
     return {
-        "id": str(user.id),
-        "email": user.email,
-        "name": user.name,
-        "usd_balance": float(user.usd_balance or 0),
+        "id": user["id"],
+        "email": user["email"],
+        "name": user["name"],
+        "usd_balance": float(user["usd_balance"]),
         "positions": [
             {
                 "id": str(pos.id),
@@ -295,39 +360,35 @@ def get_user_profile(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/cash-ledger", response_model=CashLedgerMetric)
-def get_cash_ledger(request: Request, db: Session = Depends(get_db)):
+def get_cash_ledger(
+    user_id: Optional[UUID] = Depends(get_session_user_id),
+    db: Session = Depends(get_db)
+):
     """Получить метрики денежной кассы: Free USD, Portfolio Balance, Total Equity"""
-    uid = request.session.get("user_id")
-    if not uid:
+    if not user_id:
         # Временная заглушка - всегда используем первого пользователя для тестирования
-        first_user = db.execute(select(User).limit(1)).scalar_one_or_none()
-        if not first_user:
-            raise HTTPException(status_code=404, detail="No users found")
-        user = first_user
+        user_filter = User.id == select(User.id).limit(1).scalar_subquery()
     else:
-        user = db.execute(select(User).where(User.id == uid)).scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        user_filter = User.id == user_id
     
-    # Получаем все позиции пользователя (без USD)
-    positions = db.execute(
-        select(Position).where(
-            Position.user_id == user.id,
-            Position.symbol != "USD"
-        )
-    ).scalars().all()
-    
-    # Рассчитываем Portfolio Balance (рыночная стоимость позиций)
-    portfolio_balance = Decimal("0")
+    # Баланс и все позиции пользователя (без USD) одним запросом:
+    # строка на позицию, у пользователя без позиций - одна строка с symbol = NULL
+    rows = db.execute(
+        select(User.usd_balance, Position.symbol, Position.quantity, Position.buy_price)
+        .outerjoin(Position, and_(Position.user_id == User.id, Position.symbol != "USD"))
+        .where(user_filter)
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="User not found" if user_id else "No users found")
+    positions = [row for row in rows if row.symbol is not None]
     
     # Импортируем PriceEODRepository для получения актуальных цен
     from app.services.price_eod import PriceEODRepository
     price_repo = PriceEODRepository(db)
     
-    for position in positions:
-        # Получаем текущую цену (используем аналогичную логику как в позициях)
-        latest_price = None
-        symbols_to_try = [
+    # Варианты тикера для каждой позиции (используем аналогичную логику как в позициях)
+    symbols_to_try_by_position = [
+        (position, [
             position.symbol,
             position.symbol.upper(),
             position.symbol.lower(),
@@ -335,25 +396,38 @@ def get_cash_ledger(request: Request, db: Session = Depends(get_db)):
             position.symbol.replace('.us', '.US'),
             position.symbol.replace('.US', ''),
             position.symbol.replace('.us', '')
-        ]
-        
-        for symbol_variant in symbols_to_try:
-            latest_price = price_repo.get_latest_price(symbol_variant)
-            if latest_price:
-                break
-        
-        # Рассчитываем стоимость позиции
+        ])
+        for position in positions
+    ]
+    
+    # Последние цены всех вариантов - одним пакетным запросом вместо запроса на вариант
+    latest_prices = price_repo.get_latest_prices_bulk(
+        {variant for _, symbols_to_try in symbols_to_try_by_position for variant in symbols_to_try}
+    )
+    
+    def current_price(position, symbols_to_try) -> float:
+        # Первый вариант тикера, для которого есть цена; иначе цена покупки
+        latest_price = next(
+            (latest_prices[variant] for variant in symbols_to_try if variant in latest_prices), None
+        )
         if latest_price:
-            current_price = Decimal(str(latest_price.close))
-        else:
-            # Используем цену покупки если нет обновленной цены
-            current_price = position.buy_price or Decimal("0")
-        
-        position_value = Decimal(str(position.quantity)) * current_price
-        portfolio_balance += position_value
+            return latest_price.close
+        return float(position.buy_price or 0)
+    
+    # Рассчитываем Portfolio Balance (рыночная стоимость позиций) векторно во float64:
+    # метрика для отображения, Decimal нужен только в ответе
+    quantities = np.fromiter(
+        (float(position.quantity) for position, _ in symbols_to_try_by_position),
+        dtype=np.float64, count=len(symbols_to_try_by_position),
+    )
+    prices = np.fromiter(
+        (current_price(position, symbols_to_try) for position, symbols_to_try in symbols_to_try_by_position),
+        dtype=np.float64, count=len(symbols_to_try_by_position),
+    )
+    portfolio_balance = Decimal(str(float(quantities @ prices)))
     
     # Free USD = баланс пользователя
-    free_usd = user.usd_balance or Decimal("0")
+    free_usd = rows[0].usd_balance or Decimal("0")
     
     # Total Equity = Free USD + Portfolio Balance
     total_equity = free_usd + portfolio_balance
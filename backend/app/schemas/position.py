@@ -7,7 +7,8 @@ from app.models.position import AssetClass
 
 
 class PositionCreate(BaseModel):
-    symbol: constr(strip_whitespace=True, min_length=1)
+    # Нормализуем тикер один раз при валидации: роутеры получают его уже в UPPERCASE
+    symbol: constr(strip_whitespace=True, to_upper=True, min_length=1)
     quantity: condecimal(gt=0)
     buy_price: Optional[condecimal(gt=0)] = None
     buy_date: Optional[date] = None
@@ -0,0 +1,59 @@
+"""
+Кэш GET /positions в памяти процесса (LRU по пользователям) и версии позиций.
+
+Каждое изменение позиций пользователя присваивает ему новую версию
+(bump_positions_version); закэшированные строки действительны, пока версия
+не сменилась и не истёк TTL (EOD цены обновляются без изменения позиций).
+Счётчик в памяти процесса: приложение запускается одним процессом uvicorn.
+Все, кто пишет в таблицу positions, вызывают bump_positions_version после commit.
+"""
+
+import itertools
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.core.config import settings
+from app.services.ranking_cache import invalidate_ranking_cache
+
+_positions_versions: Dict[UUID, int] = {}
+_positions_cache: "OrderedDict[UUID, Tuple[int, float, str, List[dict]]]" = OrderedDict()
+_cache_stamps = itertools.count(1)
+
+
+def positions_version(user_id: UUID) -> int:
+    """Текущая версия позиций пользователя (читать до запроса к БД)"""
+    return _positions_versions.get(user_id, 0)
+
+
+def bump_positions_version(user_id: UUID) -> None:
+    """Отметить изменение позиций пользователя (вызывать после commit)"""
+    # next() на itertools.count атомарен: параллельные изменения не теряют версию
+    _positions_versions[user_id] = next(_cache_stamps)
+    # Рейтинг пользователей считается по позициям - сбрасываем и его
+    invalidate_ranking_cache()
+
+
+def get_cached_positions(user_id: UUID) -> Optional[Tuple[str, List[dict]]]:
+    """(ETag, строки) из кэша, если версия позиций не менялась и TTL не истёк"""
+    entry = _positions_cache.get(user_id)
+    if entry is None:
+        return None
+    version, loaded_at, etag, rows = entry
+    if version != positions_version(user_id) or time.monotonic() - loaded_at >= settings.positions_cache_ttl:
+        del _positions_cache[user_id]
+        return None
+    _positions_cache.move_to_end(user_id)
+    return etag, rows
+
+
+def store_cached_positions(user_id: UUID, version: int, rows: List[dict]) -> Tuple[str, List[dict]]:
+    """Сохранить строки в кэш (LRU по пользователям); ETag уникален для каждой загрузки"""
+    etag = f'W/"{version}.{next(_cache_stamps)}"'
+    if settings.positions_cache_ttl > 0:
+        _positions_cache[user_id] = (version, time.monotonic(), etag, rows)
+        _positions_cache.move_to_end(user_id)
+        while len(_positions_cache) > max(1, settings.positions_cache_size):
+            _positions_cache.popitem(last=False)
+    return etag, rows
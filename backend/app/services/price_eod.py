@@ -1,15 +1,158 @@
-from typing import List, Dict, Optional
+import json
+import logging
+import uuid
+from typing import Iterable, List, Dict, Optional, Tuple
 from datetime import date, datetime
-from sqlalchemy.orm import Session
+
+import redis
+from sqlalchemy.orm import Session, aliased
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import desc
+from sqlalchemy import String, and_, bindparam, case, desc, func, select, tuple_
 
+from app.core.config import settings
+from app.models.position import Position
 from app.models.price_eod import PriceEOD
 
+logger = logging.getLogger(__name__)
+
+# Latest EOD price per normalized symbol; prices change at most once a day
+LATEST_PRICE_KEY = "price:eod:latest:{}"
+_PRICE_FIELDS = ("symbol", "open", "high", "low", "close", "volume", "source")
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def _price_cache() -> Optional[redis.Redis]:
+    """Shared Redis client for the latest-price cache, or None when caching is disabled"""
+    global _redis_client
+    if settings.price_cache_ttl <= 0:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _redis_client
+
+
+def _dump_price(price: PriceEOD) -> str:
+    data = {field: getattr(price, field) for field in _PRICE_FIELDS}
+    data.update(
+        id=str(price.id),
+        date=price.date.isoformat(),
+        ingested_at=price.ingested_at.isoformat() if price.ingested_at else None,
+    )
+    return json.dumps(data)
+
+
+def _load_price(raw: str) -> PriceEOD:
+    """Detached PriceEOD rebuilt from a cache entry (read-only use)"""
+    data = json.loads(raw)
+    return PriceEOD(
+        id=uuid.UUID(data["id"]),
+        date=date.fromisoformat(data["date"]),
+        ingested_at=datetime.fromisoformat(data["ingested_at"]) if data["ingested_at"] else None,
+        **{field: data[field] for field in _PRICE_FIELDS},
+    )
+
+
+def _cache_get_latest(symbols: List[str]) -> Dict[str, PriceEOD]:
+    """Cached latest prices for normalized symbols; Redis errors count as misses"""
+    cache = _price_cache()
+    if cache is None or not symbols:
+        return {}
+    try:
+        values = cache.mget([LATEST_PRICE_KEY.format(sym) for sym in symbols])
+    except redis.RedisError as e:
+        logger.debug(f"Latest price cache unavailable: {e}")
+        return {}
+    return {sym: _load_price(raw) for sym, raw in zip(symbols, values) if raw}
+
+
+def _cache_set_latest(prices: Dict[str, PriceEOD]) -> None:
+    cache = _price_cache()
+    if cache is None or not prices:
+        return
+    try:
+        pipe = cache.pipeline(transaction=False)
+        for sym, price in prices.items():
+            pipe.set(LATEST_PRICE_KEY.format(sym), _dump_price(price), ex=settings.price_cache_ttl)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug(f"Latest price cache unavailable: {e}")
+
+
+def _cache_invalidate_latest(sym: str) -> None:
+    """Drop the cached latest price for a stored symbol (and its bare form for .US symbols)"""
+    cache = _price_cache()
+    if cache is None:
+        return
+    keys = [LATEST_PRICE_KEY.format(sym)]
+    if sym.endswith(".US"):
+        keys.append(LATEST_PRICE_KEY.format(sym[:-3]))
+    try:
+        cache.delete(*keys)
+    except redis.RedisError as e:
+        logger.debug(f"Latest price cache unavailable: {e}")
+
 
 def _normalize_symbol(sym: str) -> str:
     """Normalize symbol to uppercase for consistent storage"""
-    return (sym or "").strip().upper()
+    if not sym:
+        return ""
+    # Fast path: tickers usually arrive already normalized, no need to build new strings
+    if sym.isascii() and sym.isupper() and not sym[0].isspace() and not sym[-1].isspace():
+        return sym
+    return sym.strip().upper()
+
+
+# Hot single-symbol lookups, built once at import; SQLAlchemy reuses the compiled form
+_LATEST_PRICE = (
+    select(PriceEOD)
+    .where(PriceEOD.symbol == bindparam("symbol"))
+    .order_by(desc(PriceEOD.date))
+    .limit(1)
+)
+_PRICE_ON_DATE = (
+    select(PriceEOD)
+    .where(PriceEOD.symbol == bindparam("symbol"), PriceEOD.date == bindparam("date"))
+    .limit(1)
+)
+
+
+def _stored_variants(sym: str) -> List[str]:
+    """Stored symbols checked for a normalized symbol, in order (see get_latest_price)"""
+    return [sym] if "." in sym else [sym, f"{sym}.us"]
+
+
+def eod_price_id(on_date=None):
+    """
+    Correlated subquery: id of the prices_eod row matching the enclosing Position.
+
+    Symbol variants are tried in order (case-insensitive, with a .us suffix,
+    without a .US suffix); the first one that has prices wins, and of its rows
+    the one on on_date, or the latest when on_date is None.
+    """
+    symbol = func.upper(Position.symbol, type_=String)
+    bare = func.replace(symbol, ".US", "", type_=String)
+    candidates = [symbol, symbol.concat(".us"), bare, bare.concat(".us")]
+
+    def has_prices(candidate):
+        probe = aliased(PriceEOD)
+        criteria = [probe.symbol == candidate]
+        if on_date is not None:
+            criteria.append(probe.date == on_date)
+        return select(probe.id).where(*criteria).correlate(Position).exists()
+
+    matched_symbol = case(*[(has_prices(candidate), candidate) for candidate in candidates])
+    stmt = select(PriceEOD.id).where(PriceEOD.symbol == matched_symbol)
+    if on_date is not None:
+        stmt = stmt.where(PriceEOD.date == on_date)
+    return stmt.order_by(PriceEOD.date.desc()).limit(1).correlate(Position).scalar_subquery()
 
 
 class PriceEODRepository:
@@ -59,6 +202,7 @@ class PriceEODRepository:
 
         self.db.execute(stmt)
         self.db.commit()
+        _cache_invalidate_latest(sym)
         return len(payload)
 
     def get_prices(
@@ -77,22 +221,78 @@ class PriceEODRepository:
 
     def get_latest_price(self, symbol: str) -> Optional[PriceEOD]:
         sym = _normalize_symbol(symbol)
-        obj = (
-            self.db.query(PriceEOD)
-            .filter(PriceEOD.symbol == sym)
-            .order_by(desc(PriceEOD.date))
-            .first()
-        )
-        if obj is None and "." not in sym:
-            alt = f"{sym}.us"
-            obj = (
-                self.db.query(PriceEOD)
-                .filter(PriceEOD.symbol == alt)
-                .order_by(desc(PriceEOD.date))
-                .first()
-            )
+        cached = _cache_get_latest([sym])
+        if sym in cached:
+            return cached[sym]
+
+        obj = None
+        for variant in _stored_variants(sym):
+            obj = self.db.scalars(_LATEST_PRICE, {"symbol": variant}).first()
+            if obj is not None:
+                break
+        if obj is not None:
+            _cache_set_latest({sym: obj})
         return obj
 
+    def get_latest_prices_bulk(self, symbols: Iterable[str]) -> Dict[str, PriceEOD]:
+        """
+        Latest price for many symbols in one query, same matching as get_latest_price.
+        Returns {symbol as passed: PriceEOD}; symbols without prices are omitted.
+        """
+        requested = {s: _normalize_symbol(s) for s in symbols}
+        wanted = sorted(set(requested.values()) - {""})
+        found = _cache_get_latest(wanted)
+        stored = {variant for sym in wanted if sym not in found for variant in _stored_variants(sym)}
+
+        if stored:
+            latest = (
+                select(PriceEOD.symbol, func.max(PriceEOD.date).label("date"))
+                .where(PriceEOD.symbol.in_(stored))
+                .group_by(PriceEOD.symbol)
+                .subquery()
+            )
+            rows = self.db.scalars(
+                select(PriceEOD).join(
+                    latest, and_(PriceEOD.symbol == latest.c.symbol, PriceEOD.date == latest.c.date)
+                )
+            )
+            by_stored = {row.symbol: row for row in rows}
+            loaded: Dict[str, PriceEOD] = {}
+            for sym in wanted:
+                if sym in found:
+                    continue
+                for variant in _stored_variants(sym):
+                    if variant in by_stored:
+                        loaded[sym] = by_stored[variant]
+                        break
+            _cache_set_latest(loaded)
+            found.update(loaded)
+
+        return {s: found[sym] for s, sym in requested.items() if sym in found}
+
+    def get_prices_on_date_bulk(self, requests: Iterable[Tuple[str, date]]) -> Dict[Tuple[str, date], PriceEOD]:
+        """
+        Prices for many (symbol, date) pairs in one query, same matching as get_price_on_date.
+        Returns {(symbol as passed, date): PriceEOD}; pairs without a price are omitted.
+        """
+        requested = {(s, d): (_normalize_symbol(s), d) for s, d in requests}
+        wanted = {key for key in requested.values() if key[0]}
+        stored = {(variant, d) for sym, d in wanted for variant in _stored_variants(sym)}
+        if not stored:
+            return {}
+
+        rows = self.db.scalars(
+            select(PriceEOD).where(tuple_(PriceEOD.symbol, PriceEOD.date).in_(stored))
+        )
+        by_stored = {(row.symbol, row.date): row for row in rows}
+        found: Dict[Tuple[str, date], PriceEOD] = {}
+        for sym, d in wanted:
+            for variant in _stored_variants(sym):
+                if (variant, d) in by_stored:
+                    found[(sym, d)] = by_stored[(variant, d)]
+                    break
+        return {key: found[norm] for key, norm in requested.items() if norm in found}
+
     def delete_prices(
         self,
         symbol: str,
@@ -108,26 +308,17 @@ class PriceEODRepository:
         count = q.count()
         q.delete(synchronize_session=False)
         self.db.commit()
+        _cache_invalidate_latest(sym)
         return count
 
     def get_price_on_date(self, symbol: str, target_date: date) -> Optional[PriceEOD]:
         """Получить цену на определенную дату"""
         sym = _normalize_symbol(symbol)
-        obj = (
-            self.db.query(PriceEOD)
-            .filter(PriceEOD.symbol == sym)
-            .filter(PriceEOD.date == target_date)
-            .first()
-        )
-        if obj is None and "." not in sym:
-            alt = f"{sym}.us"
-            obj = (
-                self.db.query(PriceEOD)
-                .filter(PriceEOD.symbol == alt)
-                .filter(PriceEOD.date == target_date)
-                .first()
-            )
-        return obj
+        for variant in _stored_variants(sym):
+            obj = self.db.scalars(_PRICE_ON_DATE, {"symbol": variant, "date": target_date}).first()
+            if obj is not None:
+                return obj
+        return None
 
     def get_symbols(self) -> List[str]:
         """Get all unique symbols that have price data"""
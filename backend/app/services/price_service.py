@@ -3,6 +3,7 @@
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from sqlalchemy.orm import Session
 
@@ -11,6 +12,9 @@ from app.services.price_eod import PriceEODRepository
 
 logger = logging.getLogger(__name__)
 
+# Одновременных запросов к Stooq при загрузке списка символов
+FETCH_CONCURRENCY = 8
+
 
 class PriceService:
     """Сервис для загрузки и управления ценами"""
@@ -37,29 +41,33 @@ class PriceService:
                 logger.debug(f"Price data already exists for {symbol}, skipping auto-load")
                 return False
             
-            # Загружаем данные из Stooq
-            logger.info("price_service_start", extra={"symbol": symbol})
-            latest_price = fetch_latest_from_stooq(symbol)
-            
-            if not latest_price:
-                logger.warning(f"No price data available for {symbol}")
-                return False
-            
-            # Сохраняем в базу данных
-            price_data = [latest_price]
-            inserted_count = self.repository.upsert_prices(symbol, price_data)
-            logger.info("price_service_success", extra={
-                "symbol": symbol, 
-                "rows": inserted_count, 
-                "last_date": latest_price['date']
-            })
-            
-            return True
+            return self._store_latest_price(symbol, self._fetch_latest_price(symbol))
             
         except Exception as e:
             logger.error(f"Unexpected error loading price for {symbol}: {e}")
             return False
     
+    def _fetch_latest_price(self, symbol: str) -> Optional[dict]:
+        """Загружает последнюю цену из Stooq (без обращения к БД - безопасно в потоках)"""
+        logger.info("price_service_start", extra={"symbol": symbol})
+        return fetch_latest_from_stooq(symbol)
+    
+    def _store_latest_price(self, symbol: str, latest_price: Optional[dict]) -> bool:
+        """Сохраняет загруженную цену в базу данных"""
+        if not latest_price:
+            logger.warning(f"No price data available for {symbol}")
+            return False
+        
+        price_data = [latest_price]
+        inserted_count = self.repository.upsert_prices(symbol, price_data)
+        logger.info("price_service_success", extra={
+            "symbol": symbol, 
+            "rows": inserted_count, 
+            "last_date": latest_price['date']
+        })
+        
+        return True
+    
     def load_prices_for_symbols(self, symbols: List[str]) -> Dict[str, bool]:
         """
         Загружает цены для списка символов.
@@ -70,9 +78,31 @@ class PriceService:
         Returns:
             Словарь с результатами: {symbol: success}
         """
-        results = {}
-        for symbol in symbols:
-            results[symbol] = self.load_price_for_symbol(symbol)
+        # Какие символы уже есть в базе - одним запросом
+        existing = self.repository.get_latest_prices_bulk(symbols)
+        results = {symbol: False for symbol in symbols}
+        missing = [symbol for symbol in results if symbol not in existing]
+        if not missing:
+            return results
+        
+        # HTTP-запросы к Stooq идут параллельно; запись в БД - последовательно,
+        # т.к. сессия не потокобезопасна
+        def fetch(symbol: str):
+            try:
+                return self._fetch_latest_price(symbol), None
+            except Exception as e:
+                return None, e
+        
+        with ThreadPoolExecutor(max_workers=min(FETCH_CONCURRENCY, len(missing))) as pool:
+            fetched = list(pool.map(fetch, missing))
+        
+        for symbol, (latest_price, error) in zip(missing, fetched):
+            try:
+                if error is not None:
+                    raise error
+                results[symbol] = self._store_latest_price(symbol, latest_price)
+            except Exception as e:
+                logger.error(f"Unexpected error loading price for {symbol}: {e}")
         return results
     
     def check_stooq_availability(self) -> bool:
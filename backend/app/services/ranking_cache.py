@@ -0,0 +1,70 @@
+"""
+Кэш рейтинга пользователей (/users/ranking) в Redis с коротким TTL.
+Рейтинг меняется медленно, поэтому повторные запросы не пересчитывают его по БД;
+хранится готовый JSON ответа, изменения позиций сбрасывают кэш (invalidate_ranking_cache).
+"""
+
+import logging
+from typing import Optional
+
+import redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RANKING_CACHE_KEY = "ranking:v1"
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def _ranking_cache() -> Optional[redis.Redis]:
+    """Общий Redis клиент кэша рейтинга или None, если кэш выключен"""
+    global _redis_client
+    if settings.ranking_cache_ttl <= 0:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _redis_client
+
+
+def get_cached_ranking() -> Optional[str]:
+    """JSON рейтинга из кэша или None (промах, кэш выключен или Redis недоступен)"""
+    client = _ranking_cache()
+    if client is None:
+        return None
+    try:
+        cached = client.get(RANKING_CACHE_KEY)
+    except redis.RedisError as e:
+        logger.debug(f"Ranking cache read failed: {e}")
+        return None
+    return cached or None
+
+
+def cache_ranking(payload: bytes) -> None:
+    """Сохранить JSON рейтинга в кэш на ranking_cache_ttl секунд"""
+    client = _ranking_cache()
+    if client is None:
+        return
+    try:
+        client.set(RANKING_CACHE_KEY, payload, ex=settings.ranking_cache_ttl)
+    except redis.RedisError as e:
+        logger.debug(f"Ranking cache write failed: {e}")
+
+
+def invalidate_ranking_cache() -> None:
+    """Сбросить кэш рейтинга (вызывать после изменения позиций)"""
+    client = _ranking_cache()
+    if client is None:
+        return
+    try:
+        client.delete(RANKING_CACHE_KEY)
+    except redis.RedisError as e:
+        logger.debug(f"Ranking cache invalidation failed: {e}")
@@ -11,6 +11,8 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 import math
 
+import numpy as np
+
 from app.schemas_sentiment import (
     SentimentScoreResponse, SentimentResult, SentimentLabel, SentimentBucket,
     SentimentGrouping, PortfolioSentimentMetrics, PositionSentimentData,
@@ -130,38 +132,34 @@ class SentimentAggregationService:
     ) -> PortfolioSentimentMetrics:
         """Вычисление портфельного сентимента с учетом весов позиций"""
         
-        portfolio_weight_sum_7d = 0.0
-        portfolio_weight_sum_30d = 0.0
-        portfolio_sentiment_sum_7d = 0.0
-        portfolio_sentiment_sum_30d = 0.0
-        
-        bullish_count = 0
-        neutral_count = 0
-        bear_count = 0
-        
-        # Взвешенная сумма
-        for symbol, position_weight in position_weights.items():
-            if symbol in symbol_sentiment_7d:
-                sentiment_7d = symbol_sentiment_7d[symbol]['sentiment_score']
-                coverage_7d = symbol_sentiment_7d[symbol]['coverage_count']
-                
-                portfolio_weight_sum_7d += position_weight
-                portfolio_sentiment_sum_7d += sentiment_7d * position_weight
-            
-            if symbol in symbol_sentiment_30d:
-                sentiment_30d = symbol_sentiment_30d[symbol]['sentiment_score']
-                coverage_30d = symbol_sentiment_30d[symbol]['coverage_count']
-                
-                portfolio_weight_sum_30d += position_weight
-                portfolio_sentiment_sum_30d += sentiment_30d * position_weight
-                
-                # Категоризация для подсчета
-                if sentiment_30d >= self.config.bullish_threshold:
-                    bullish_count += 1
-                elif sentiment_30d <= self.config.bearish_threshold:
-                    bear_count += 1
-                else:
-                    neutral_count += 1
+        # Выравниваем данные по тикерам в массивы (SoA): веса и оценки по индексу позиции,
+        # тикеры без sentiment данных получают оценку 0 и маску False
+        symbols = list(position_weights)
+        count = len(symbols)
+        weights = np.fromiter(position_weights.values(), dtype=np.float64, count=count)
+        has_7d = np.fromiter((symbol in symbol_sentiment_7d for symbol in symbols), dtype=bool, count=count)
+        has_30d = np.fromiter((symbol in symbol_sentiment_30d for symbol in symbols), dtype=bool, count=count)
+        scores_7d = np.fromiter(
+            (symbol_sentiment_7d[symbol]['sentiment_score'] if symbol in symbol_sentiment_7d else 0.0 for symbol in symbols),
+            dtype=np.float64, count=count
+        )
+        scores_30d = np.fromiter(
+            (symbol_sentiment_30d[symbol]['sentiment_score'] if symbol in symbol_sentiment_30d else 0.0 for symbol in symbols),
+            dtype=np.float64, count=count
+        )
+        
+        # Взвешенная сумма - скалярное произведение
+        portfolio_weight_sum_7d = float(weights[has_7d].sum())
+        portfolio_weight_sum_30d = float(weights[has_30d].sum())
+        portfolio_sentiment_sum_7d = float(np.dot(weights, scores_7d))
+        portfolio_sentiment_sum_30d = float(np.dot(weights, scores_30d))
+        
+        # Категоризация для подсчета (по 30d)
+        covered_30d = scores_30d[has_30d]
+        is_bullish = covered_30d >= self.config.bullish_threshold
+        bullish_count = int(is_bullish.sum())
+        bear_count = int((~is_bullish & (covered_30d <= self.config.bearish_threshold)).sum())
+        neutral_count = len(covered_30d) - bullish_count - bear_count
         
         # Финальные расчеты (избегаем деления на ноль)
         portfolio_sentiment_7d = portfolio_sentiment_sum_7d / portfolio_weight_sum_7d if portfolio_weight_sum_7d > 0 else 0.0
@@ -309,6 +307,30 @@ class SentimentAggregationService:
         
         return None
     
+    async def get_cached_sentiment_bulk(self, symbols: List[str]) -> Dict[str, CachedSentimentData]:
+        """Получение кэшированных sentiment данных для списка символов одним MGET"""
+        
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        
+        try:
+            cached_values = self.redis_client.mget([f"sentiment:{symbol}" for symbol in symbols])
+        except Exception as e:
+            logger.error(f"Failed to get cached sentiment for {len(symbols)} symbols: {e}")
+            return {}
+        
+        result = {}
+        for symbol, cached_json in zip(symbols, cached_values):
+            if not cached_json:
+                continue
+            try:
+                result[symbol] = CachedSentimentData(**json.loads(cached_json))
+            except Exception as e:
+                logger.error(f"Failed to get cached sentiment for {symbol}: {e}")
+        
+        return result
+    
     async def invalidate_cache(self, symbol: Optional[str] = None) -> None:
         """Инвалидация кэша (для форс-рефреша)"""
         
@@ -323,3 +345,14 @@ class SentimentAggregationService:
             if keys:
                 self.redis_client.delete(*keys)
                 logger.info(f"Invalidated {len(keys)} sentiment cache entries")
+
+
+# Singleton instance
+_sentiment_aggregation_service: Optional[SentimentAggregationService] = None
+
+def get_sentiment_aggregation_service() -> SentimentAggregationService:
+    """Получить singleton instance сервиса агрегации (один Redis пул на процесс)"""
+    global _sentiment_aggregation_service
+    if _sentiment_aggregation_service is None:
+        _sentiment_aggregation_service = SentimentAggregationService()
+    return _sentiment_aggregation_service
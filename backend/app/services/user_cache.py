@@ -0,0 +1,90 @@
+"""
+Кэш строки пользователя (email, name, usd_balance) в Redis по user_id.
+/me, /profile и /cash-ledger опрашиваются SPA постоянно, а строка меняется редко;
+все места, меняющие usd_balance, вызывают invalidate_user_cache после commit.
+"""
+
+import json
+import logging
+from decimal import Decimal
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_KEY = "user:{}"
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def _user_cache() -> Optional[redis.Redis]:
+    """Общий Redis клиент кэша пользователей или None, если кэш выключен"""
+    global _redis_client
+    if settings.user_cache_ttl <= 0:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _redis_client
+
+
+def get_user_cached(db: Session, user_id: UUID) -> Optional[Dict[str, Any]]:
+    """
+    Пользователь как {"id", "email", "name", "usd_balance": Decimal}; None, если его нет.
+    Промах кэша или недоступный Redis - читаем из БД.
+    """
+    client = _user_cache()
+    key = USER_CACHE_KEY.format(user_id)
+    if client is not None:
+        try:
+            cached = client.get(key)
+        except redis.RedisError as e:
+            logger.debug(f"User cache read failed: {e}")
+            cached = None
+        if cached:
+            user = json.loads(cached)
+            user["usd_balance"] = Decimal(user["usd_balance"])
+            return user
+
+    row = db.execute(
+        select(User.id, User.email, User.name, User.usd_balance).where(User.id == user_id)
+    ).one_or_none()
+    if row is None:
+        return None
+
+    user = {
+        "id": str(row.id),
+        "email": row.email,
+        "name": row.name,
+        "usd_balance": row.usd_balance if row.usd_balance is not None else Decimal("0"),
+    }
+    if client is not None:
+        try:
+            client.set(key, json.dumps({**user, "usd_balance": str(user["usd_balance"])}), ex=settings.user_cache_ttl)
+        except redis.RedisError as e:
+            logger.debug(f"User cache write failed: {e}")
+    return user
+
+
+def invalidate_user_cache(user_id: UUID) -> None:
+    """Сбросить кэш пользователя (вызывать после изменения его строки)"""
+    client = _user_cache()
+    if client is None:
+        return
+    try:
+        client.delete(USER_CACHE_KEY.format(user_id))
+    except redis.RedisError as e:
+        logger.debug(f"User cache invalidation failed: {e}")
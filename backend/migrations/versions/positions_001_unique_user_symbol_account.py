@@ -0,0 +1,111 @@
+"""Add unique (user_id, symbol, account) constraint on positions
+
+Revision ID: positions_001
+Revises: user_intel_001
+Create Date: 2025-10-17
+
+Changes:
+0. Abort if duplicates disagree on currency or asset_class (they cannot be merged)
+1. Merge duplicate positions with the same (user_id, symbol, account)
+2. Add uq_positions_user_symbol_account (NULLS NOT DISTINCT, PostgreSQL 15+)
+3. Add composite index ix_positions_user_id_id for (user_id, id) lookups
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'positions_001'
+down_revision = 'user_intel_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 0. Дубликаты с разной валютой или классом актива слить нельзя - останавливаемся,
+    #    их нужно разобрать вручную до миграции
+    conflicts = op.get_bind().execute(sa.text("""
+        SELECT user_id, symbol, account,
+               string_agg(DISTINCT currency, ', ') AS currencies,
+               string_agg(DISTINCT asset_class::text, ', ') AS asset_classes
+        FROM positions
+        GROUP BY user_id, symbol, account
+        HAVING COUNT(DISTINCT currency) > 1 OR COUNT(DISTINCT asset_class) > 1
+        ORDER BY user_id, symbol, account
+    """)).all()
+    if conflicts:
+        groups = "\n".join(
+            f"  user_id={row.user_id} symbol={row.symbol} account={row.account}: "
+            f"currency [{row.currencies}], asset_class [{row.asset_classes}]"
+            for row in conflicts
+        )
+        raise RuntimeError(
+            "Cannot merge duplicate positions with different currency or asset_class; "
+            f"resolve these (user_id, symbol, account) groups manually and rerun the migration:\n{groups}"
+        )
+
+    # 1. Сливаем дубликаты в самую раннюю позицию группы:
+    #    количество суммируется, цена - средневзвешенная, дата покупки - последняя
+    op.execute("""
+        WITH ranked AS (
+            SELECT id,
+                   row_number() OVER (
+                       PARTITION BY user_id, symbol, account
+                       ORDER BY date_added, id
+                   ) AS rn
+            FROM positions
+        ),
+        merged AS (
+            SELECT user_id, symbol, account,
+                   SUM(quantity) AS quantity,
+                   SUM(quantity * buy_price) / NULLIF(SUM(quantity) FILTER (WHERE buy_price IS NOT NULL), 0) AS buy_price,
+                   MAX(buy_date) AS buy_date
+            FROM positions
+            GROUP BY user_id, symbol, account
+            HAVING COUNT(*) > 1
+        )
+        UPDATE positions p
+        SET quantity = merged.quantity,
+            buy_price = merged.buy_price,
+            buy_date = merged.buy_date
+        FROM merged, ranked
+        WHERE ranked.id = p.id
+          AND ranked.rn = 1
+          AND merged.user_id = p.user_id
+          AND merged.symbol = p.symbol
+          AND merged.account IS NOT DISTINCT FROM p.account
+    """)
+    op.execute("""
+        DELETE FROM positions p
+        USING (
+            SELECT id,
+                   row_number() OVER (
+                       PARTITION BY user_id, symbol, account
+                       ORDER BY date_added, id
+                   ) AS rn
+            FROM positions
+        ) ranked
+        WHERE ranked.id = p.id AND ranked.rn > 1
+    """)
+
+    # 2. Уникальность позиции; NULL-счета считаются равными
+    op.create_unique_constraint(
+        'uq_positions_user_symbol_account',
+        'positions',
+        ['user_id', 'symbol', 'account'],
+        postgresql_nulls_not_distinct=True
+    )
+
+    # 3. Индекс для выборок по (user_id, id)
+    op.create_index(
+        'ix_positions_user_id_id',
+        'positions',
+        ['user_id', 'id'],
+        unique=False
+    )
+
+
+def downgrade():
+    # Слитые дубликаты не восстанавливаются
+    op.drop_index('ix_positions_user_id_id', table_name='positions')
+    op.drop_constraint('uq_positions_user_symbol_account', 'positions', type_='unique')
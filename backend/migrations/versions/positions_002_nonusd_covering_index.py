@@ -0,0 +1,38 @@
+"""Add partial covering index for non-USD positions
+
+Revision ID: positions_002
+Revises: positions_001
+Create Date: 2026-10-17
+
+Changes:
+1. Add ix_positions_nonusd on (user_id) INCLUDE (symbol, quantity, buy_price)
+   WHERE symbol <> 'USD' - /users/ranking and /users/cash-ledger aggregate
+   holdings without cash and can be served by an index-only scan
+
+(user_id, symbol) lookups are already covered by uq_positions_user_symbol_account.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'positions_002'
+down_revision = 'positions_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Частичный покрывающий индекс: позиции без USD-кэша по пользователю
+    op.create_index(
+        'ix_positions_nonusd',
+        'positions',
+        ['user_id'],
+        unique=False,
+        postgresql_include=['symbol', 'quantity', 'buy_price'],
+        postgresql_where=sa.text("symbol <> 'USD'"),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_positions_nonusd', table_name='positions')
@@ -6,7 +6,7 @@ import pytest
 from decimal import Decimal
 from datetime import date
 from uuid import UUID
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 
 from app.models import Position, User, PriceEOD
 from app.services.price_service import PriceService
@@ -202,7 +202,7 @@ class TestAutoPriceLoading:
                 assert response.status_code == 200
                 
                 # Проверяем, что автозагрузка вызвана с нормализованным символом
-                mock_load_price.assert_called_once_with(expected_symbol, db_session)
+                mock_load_price.assert_called_once_with(expected_symbol, ANY)
 
     def test_usd_symbol_skipped_in_bulk_loading(self, client, db_session):
         """Тест: USD символ пропускается при массовой загрузке"""
@@ -325,7 +325,7 @@ class TestLegacyPositionEndpoint:
             assert data["symbol"] == "GOOGL"
             
             # Проверяем, что автозагрузка вызвана
-            mock_load_price.assert_called_once_with("GOOGL", db_session)
+            mock_load_price.assert_called_once_with("GOOGL", ANY)
 
 
 
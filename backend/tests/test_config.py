@@ -0,0 +1,18 @@
+"""
+Tests for Settings.database_url driver selection
+"""
+import pytest
+
+from app.core.config import Settings
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("postgresql://u:p@db:5432/app", "postgresql+psycopg://u:p@db:5432/app"),
+    ("postgres://u:p@db:5432/app", "postgresql+psycopg://u:p@db:5432/app"),
+    ("postgresql+psycopg://u:p@db:5432/app", "postgresql+psycopg://u:p@db:5432/app"),
+    ("postgresql+psycopg2://u:p@db:5432/app", "postgresql+psycopg2://u:p@db:5432/app"),
+    ("sqlite:///./test.db", "sqlite:///./test.db"),
+])
+def test_database_url_pins_psycopg_driver(url, expected):
+    """Plain PostgreSQL URLs use psycopg 3 (needed for the bulk COPY import); explicit drivers are kept"""
+    assert Settings(DATABASE_URL=url).database_url == expected
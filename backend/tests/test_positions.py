@@ -1,9 +1,12 @@
 import pytest
 from decimal import Decimal
 from datetime import date
+from unittest.mock import patch
 from uuid import UUID
 
+from app.core.config import settings
 from app.models import Position, User
+from app.routers import positions as positions_router
 
 
 def test_create_position_model(db_session):
@@ -193,3 +196,316 @@ def test_validation_errors_api(client, db_session):
         "buy_price": "-150"
     }, params={"user_id": str(test_user.id)})
     assert response.status_code == 422
+
+
+def _pg_user(session, email, usd_balance=Decimal("0")):
+    user = User(email=email, usd_balance=usd_balance)
+    session.add(user)
+    session.commit()
+    return user
+
+
+def _pg_position(session, user, symbol="AAPL", quantity=Decimal("10"), buy_price=Decimal("100"), account=None):
+    position = Position(user_id=user.id, symbol=symbol, quantity=quantity, buy_price=buy_price, account=account)
+    session.add(position)
+    session.commit()
+    return position
+
+
+def test_sell_position_partial(pg_client, pg_session, auth_headers):
+    """Тест частичной продажи: остаток количества и зачисление USD"""
+    user = _pg_user(pg_session, "seller@example.com")
+    position = _pg_position(pg_session, user)
+
+    response = pg_client.post("/positions/sell", headers=auth_headers(user), json={
+        "position_id": str(position.id), "quantity": "4", "sell_price": "150"
+    })
+
+    assert response.status_code == 200
+    assert Decimal(str(response.json()["quantity"])) == Decimal("6")
+    pg_session.expire_all()
+    assert pg_session.get(Position, position.id).quantity == Decimal("6")
+    assert pg_session.get(User, user.id).usd_balance == Decimal("600")
+
+
+def test_sell_position_full_deletes_row(pg_client, pg_session, auth_headers):
+    """Тест полной продажи: позиция удаляется, без sell_price зачисляется по buy_price"""
+    user = _pg_user(pg_session, "seller@example.com", usd_balance=Decimal("50"))
+    position = _pg_position(pg_session, user)
+
+    response = pg_client.post("/positions/sell", headers=auth_headers(user), json={
+        "position_id": str(position.id), "quantity": "10"
+    })
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Position sold completely and deleted"}
+    pg_session.expire_all()
+    assert pg_session.get(Position, position.id) is None
+    assert pg_session.get(User, user.id).usd_balance == Decimal("1050")
+
+
+def test_sell_position_oversell_rejected(pg_client, pg_session, auth_headers):
+    """Тест продажи больше, чем есть: 400, позиция и баланс не меняются"""
+    user = _pg_user(pg_session, "seller@example.com", usd_balance=Decimal("50"))
+    position = _pg_position(pg_session, user)
+
+    response = pg_client.post("/positions/sell", headers=auth_headers(user), json={
+        "position_id": str(position.id), "quantity": "11", "sell_price": "150"
+    })
+
+    assert response.status_code == 400
+    pg_session.expire_all()
+    assert pg_session.get(Position, position.id).quantity == Decimal("10")
+    assert pg_session.get(User, user.id).usd_balance == Decimal("50")
+
+
+def test_sell_position_not_found(pg_client, pg_session, auth_headers):
+    """Тест продажи несуществующей или чужой позиции: 404"""
+    owner = _pg_user(pg_session, "owner@example.com")
+    intruder = _pg_user(pg_session, "intruder@example.com")
+    position = _pg_position(pg_session, owner)
+
+    response = pg_client.post("/positions/sell", headers=auth_headers(intruder), json={
+        "position_id": "00000000-0000-0000-0000-0000000000ff", "quantity": "1"
+    })
+    assert response.status_code == 404
+
+    response = pg_client.post("/positions/sell", headers=auth_headers(intruder), json={
+        "position_id": str(position.id), "quantity": "1", "sell_price": "150"
+    })
+    assert response.status_code == 404
+    pg_session.expire_all()
+    assert pg_session.get(Position, position.id).quantity == Decimal("10")
+    assert pg_session.get(User, owner.id).usd_balance == Decimal("0")
+    assert pg_session.get(User, intruder.id).usd_balance == Decimal("0")
+
+
+def test_get_positions_etag_not_modified(pg_client, pg_session, auth_headers):
+    """Тест ETag: повторный запрос с If-None-Match получает 304 без тела"""
+    user = _pg_user(pg_session, "etag@example.com")
+    _pg_position(pg_session, user)
+    headers = auth_headers(user)
+
+    response = pg_client.get("/positions", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = pg_client.get("/positions", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+POSITION_MUTATIONS = {
+    "create": lambda client, headers, position: client.post(
+        "/positions", headers=headers, json={"symbol": "MSFT", "quantity": "1", "buy_price": "300"}
+    ),
+    "bulk": lambda client, headers, position: client.post(
+        "/positions/bulk_json", headers=headers, json=[{"symbol": "MSFT", "quantity": "1", "buy_price": "300"}]
+    ),
+    "update": lambda client, headers, position: client.patch(
+        f"/positions/{position.id}", headers=headers, json={"quantity": "20"}
+    ),
+    "sell": lambda client, headers, position: client.post(
+        "/positions/sell", headers=headers, json={"position_id": str(position.id), "quantity": "1"}
+    ),
+    "delete": lambda client, headers, position: client.delete(f"/positions/{position.id}", headers=headers),
+    "add": lambda client, headers, position: client.post(
+        "/positions/add", headers=headers, params={"symbol": "AAPL", "quantity": 5, "price": 120}
+    ),
+}
+
+
+@pytest.mark.parametrize("mutation", list(POSITION_MUTATIONS))
+def test_positions_etag_changes_after_mutation(pg_client, pg_session, auth_headers, mutation):
+    """Тест ETag: любое изменение позиций сбрасывает кэш и меняет ETag"""
+    user = _pg_user(pg_session, "etag@example.com")
+    position = _pg_position(pg_session, user)
+    headers = auth_headers(user)
+
+    before = pg_client.get("/positions", headers=headers)
+    etag = before.headers["ETag"]
+
+    response = POSITION_MUTATIONS[mutation](pg_client, headers, position)
+    assert response.status_code == 200
+
+    after = pg_client.get("/positions", headers={**headers, "If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert after.json() != before.json()
+
+
+def test_positions_cache_isolated_per_user(pg_client, pg_session, auth_headers):
+    """Тест кэша GET /positions: один пользователь никогда не получает позиции другого"""
+    alice = _pg_user(pg_session, "alice@example.com")
+    bob = _pg_user(pg_session, "bob@example.com")
+    _pg_position(pg_session, alice, symbol="AAPL")
+    _pg_position(pg_session, bob, symbol="TSLA")
+
+    alice_response = pg_client.get("/positions", headers=auth_headers(alice))
+    bob_response = pg_client.get("/positions", headers=auth_headers(bob))
+    assert [p["symbol"] for p in alice_response.json()] == ["AAPL"]
+    assert [p["symbol"] for p in bob_response.json()] == ["TSLA"]
+
+    # Чужой ETag не даёт 304
+    response = pg_client.get(
+        "/positions", headers={**auth_headers(bob), "If-None-Match": alice_response.headers["ETag"]}
+    )
+    assert response.status_code == 200
+    assert [p["symbol"] for p in response.json()] == ["TSLA"]
+
+    # Изменение позиций одного пользователя не трогает кэш другого
+    pg_client.post("/positions", headers=auth_headers(alice), json={"symbol": "MSFT", "quantity": "1"})
+    response = pg_client.get(
+        "/positions", headers={**auth_headers(bob), "If-None-Match": bob_response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert {p["symbol"] for p in pg_client.get("/positions", headers=auth_headers(alice)).json()} == {"AAPL", "MSFT"}
+
+
+def _pg_lots(session, user):
+    """Позиции пользователя: {(symbol, account): Position}"""
+    session.expire_all()
+    rows = session.query(Position).filter(Position.user_id == user.id).all()
+    return {(row.symbol, row.account): row for row in rows}
+
+
+def test_bulk_json_merges_duplicate_symbols(pg_client, pg_session, auth_headers):
+    """Тест bulk_json: повторы тикера в одном запросе сливаются в одну позицию"""
+    user = _pg_user(pg_session, "bulk@example.com")
+
+    response = pg_client.post("/positions/bulk_json", headers=auth_headers(user), json=[
+        {"symbol": "AAPL", "quantity": "10", "buy_price": "100", "buy_date": "2024-01-01"},
+        {"symbol": "aapl", "quantity": "30", "buy_price": "200", "buy_date": "2024-03-01"},
+        {"symbol": "AAPL", "quantity": "5", "account": "ira"},
+        {"symbol": "MSFT", "quantity": "1", "buy_price": "300"},
+    ])
+
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 3, "updated": 1, "failed": 0, "errors": []}
+    lots = _pg_lots(pg_session, user)
+    assert set(lots) == {("AAPL", None), ("AAPL", "ira"), ("MSFT", None)}
+    assert lots[("AAPL", None)].quantity == Decimal("40")
+    assert lots[("AAPL", None)].buy_price == Decimal("175")
+    assert lots[("AAPL", None)].buy_date == date(2024, 3, 1)
+
+
+def test_bulk_json_merges_into_existing_lots(pg_client, pg_session, auth_headers):
+    """Тест bulk_json: слияние с существующими позициями, включая NULL buy_price"""
+    user = _pg_user(pg_session, "bulk@example.com")
+    _pg_position(pg_session, user, symbol="AAPL", quantity=Decimal("10"), buy_price=Decimal("100"), account="main")
+    _pg_position(pg_session, user, symbol="TSLA", quantity=Decimal("5"), buy_price=None)
+    _pg_position(pg_session, user, symbol="NVDA", quantity=Decimal("4"), buy_price=Decimal("50"))
+
+    response = pg_client.post("/positions/bulk_json", headers=auth_headers(user), json=[
+        {"symbol": "AAPL", "quantity": "30", "buy_price": "200", "account": "main"},
+        {"symbol": "TSLA", "quantity": "5", "buy_price": "300"},
+        {"symbol": "NVDA", "quantity": "4"},
+    ])
+
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 0, "updated": 3, "failed": 0, "errors": []}
+    lots = _pg_lots(pg_session, user)
+    assert len(lots) == 3
+    assert (lots[("AAPL", "main")].quantity, lots[("AAPL", "main")].buy_price) == (Decimal("40"), Decimal("175"))
+    # Старая цена NULL - берётся новая, новая NULL - остаётся старая
+    assert (lots[("TSLA", None)].quantity, lots[("TSLA", None)].buy_price) == (Decimal("10"), Decimal("300"))
+    assert (lots[("NVDA", None)].quantity, lots[("NVDA", None)].buy_price) == (Decimal("8"), Decimal("50"))
+
+
+def test_create_position_merges_lot_without_account(pg_client, pg_session, auth_headers):
+    """Тест _upsert_lot: позиции без счёта (NULL) сливаются, а не дублируются"""
+    user = _pg_user(pg_session, "lots@example.com")
+    headers = auth_headers(user)
+
+    first = pg_client.post("/positions", headers=headers, json={"symbol": "AAPL", "quantity": "10", "buy_price": "100"})
+    second = pg_client.post("/positions", headers=headers, json={"symbol": "AAPL", "quantity": "30", "buy_price": "200"})
+    legacy = pg_client.post("/positions/add", headers=headers, params={"symbol": "aapl", "quantity": 10, "price": 50})
+
+    assert first.status_code == second.status_code == legacy.status_code == 200
+    assert second.json()["id"] == first.json()["id"]
+    lots = _pg_lots(pg_session, user)
+    assert list(lots) == [("AAPL", None)]
+    assert lots[("AAPL", None)].quantity == Decimal("50")
+    assert lots[("AAPL", None)].buy_price == Decimal("150")
+
+
+def test_create_position_rejects_other_asset_class(pg_client, pg_session, auth_headers, monkeypatch):
+    """Тест _upsert_lot: лот другого класса актива не сливается с позицией"""
+    monkeypatch.setattr(settings, "feature_crypto_positions", True)
+    user = _pg_user(pg_session, "lots@example.com")
+    _pg_position(pg_session, user, symbol="BTC")
+
+    response = pg_client.post("/positions", headers=auth_headers(user), json={
+        "symbol": "BTC", "quantity": "1", "buy_price": "60000", "asset_class": "CRYPTO"
+    })
+
+    assert response.status_code == 400
+    assert "different asset class" in response.json()["detail"]
+    assert _pg_lots(pg_session, user)[("BTC", None)].quantity == Decimal("10")
+
+
+@pytest.mark.parametrize("count, copied", [(3, False), (4, True)])
+def test_bulk_json_copy_threshold(pg_client, pg_session, auth_headers, monkeypatch, count, copied):
+    """Тест bulk_json: COPY только для пакетов больше POSITIONS_BULK_COPY_THRESHOLD, результат тот же"""
+    monkeypatch.setattr(settings, "positions_bulk_copy_threshold", 3)
+    monkeypatch.setattr(settings, "positions_bulk_chunk_size", 2)
+    user = _pg_user(pg_session, "copy@example.com")
+    _pg_position(pg_session, user, symbol="MSFT", quantity=Decimal("1"), buy_price=Decimal("100"))
+    payload = [
+        {"symbol": "AAPL", "quantity": "10", "buy_price": "100"},
+        {"symbol": "AAPL", "quantity": "30", "buy_price": "200"},
+        {"symbol": "MSFT", "quantity": "3", "buy_price": "300"},
+        {"symbol": "AAPL", "quantity": "10", "account": "ira"},
+    ][:count]
+
+    with patch.object(positions_router, "_copy_import_lots", wraps=positions_router._copy_import_lots) as copy_import:
+        response = pg_client.post("/positions/bulk_json", headers=auth_headers(user), json=payload)
+
+    assert response.status_code == 200
+    assert copy_import.called is copied
+    assert response.json() == {"inserted": count - 2, "updated": 2, "failed": 0, "errors": []}
+    lots = _pg_lots(pg_session, user)
+    assert (lots[("AAPL", None)].quantity, lots[("AAPL", None)].buy_price) == (Decimal("40"), Decimal("175"))
+    assert (lots[("MSFT", None)].quantity, lots[("MSFT", None)].buy_price) == (Decimal("4"), Decimal("250"))
+    assert (("AAPL", "ira") in lots) is copied
+
+
+def test_bulk_json_reports_failed_chunk(pg_client, pg_session, auth_headers, monkeypatch):
+    """Тест bulk_json: ошибка в порции откатывает только её и попадает в failed/errors"""
+    monkeypatch.setattr(settings, "positions_bulk_chunk_size", 2)
+    user = _pg_user(pg_session, "bulk@example.com")
+
+    response = pg_client.post("/positions/bulk_json", headers=auth_headers(user), json=[
+        {"symbol": "AAPL", "quantity": "10", "buy_price": "100"},
+        {"symbol": "MSFT", "quantity": "1", "buy_price": "300"},
+        # Не помещается в Numeric(20, 8) - порция 3-4 откатывается целиком
+        {"symbol": "TSLA", "quantity": "10000000000000"},
+        {"symbol": "NVDA", "quantity": "1"},
+        {"symbol": "AMZN", "quantity": "2"},
+    ])
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"], result["failed"]) == (3, 0, 2)
+    assert len(result["errors"]) == 1
+    assert result["errors"][0].startswith("Rows 3-4:")
+    assert set(_pg_lots(pg_session, user)) == {("AAPL", None), ("MSFT", None), ("AMZN", None)}
+
+
+def test_positions_etag_changes_after_balance_update(pg_client, pg_session, auth_headers):
+    """Тест ETag: PUT /users/balance меняет USD позицию и сбрасывает кэш GET /positions"""
+    # Сессия для /users/balance
+    pg_client.post("/users/register", params={"email": "cash@example.com", "name": "Cash"})
+    user = pg_session.query(User).filter(User.email == "cash@example.com").one()
+    headers = auth_headers(user)
+
+    assert pg_client.put("/users/balance", json={"usd_balance": 100}).status_code == 200
+    before = pg_client.get("/positions", headers=headers)
+    assert [(p["symbol"], Decimal(str(p["quantity"]))) for p in before.json()] == [("USD", Decimal("100"))]
+
+    assert pg_client.put("/users/balance", json={"usd_balance": 250}).status_code == 200
+    after = pg_client.get("/positions", headers={**headers, "If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert [(p["symbol"], Decimal(str(p["quantity"]))) for p in after.json()] == [("USD", Decimal("250"))]
@@ -0,0 +1,89 @@
+"""
+Тесты рейтинга пользователей /users/ranking (PostgreSQL, см. TEST_POSTGRES_URL)
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app.models import Position, User
+from app.models.price_eod import PriceEOD
+from app.services import ranking_cache
+
+
+@pytest.fixture
+def ranked_users(pg_session):
+    """Три пользователя: прибыль, убыток и позиция без цен"""
+    alice = User(email="alice@example.com", name="Alice", usd_balance=Decimal("1000"))
+    bob = User(email="bob@example.com", name="Bob")
+    carol = User(email="carol@example.com")
+    pg_session.add_all([alice, bob, carol])
+    pg_session.flush()
+
+    pg_session.add_all([
+        Position(user_id=alice.id, symbol="AAPL", quantity=Decimal("10"), buy_price=Decimal("100")),
+        # Нет EOD цены - стоимость по цене покупки
+        Position(user_id=alice.id, symbol="MSFT", quantity=Decimal("2"), buy_price=Decimal("50")),
+        # USD в рейтинг не входит
+        Position(user_id=alice.id, symbol="USD", quantity=Decimal("500"), buy_price=Decimal("1")),
+        Position(user_id=bob.id, symbol="TSLA", quantity=Decimal("5"), buy_price=Decimal("200")),
+        Position(user_id=carol.id, symbol="NVDA", quantity=Decimal("1"), buy_price=None),
+        PriceEOD(symbol="AAPL", date=date(2024, 1, 1), close=120.0),
+        PriceEOD(symbol="AAPL", date=date(2024, 1, 2), close=150.0),
+        # Тикер с суффиксом биржи .us
+        PriceEOD(symbol="TSLA.us", date=date(2024, 1, 2), close=180.0),
+    ])
+    pg_session.commit()
+    return alice, bob, carol
+
+
+def _ranking(client):
+    response = client.get("/users/ranking")
+    assert response.status_code == 200
+    return {row["email"]: row for row in response.json()}
+
+
+def test_ranking_values_and_order(pg_client, ranked_users):
+    """Тест рейтинга: стоимость по последней EOD цене, PnL и порядок по PnL %"""
+    ranking = _ranking(pg_client)
+
+    alice = ranking["alice@example.com"]
+    assert alice["name"] == "Alice"
+    assert alice["total_invested"] == pytest.approx(1100)
+    assert alice["total_value"] == pytest.approx(1600)
+    assert alice["pnl_abs"] == pytest.approx(500)
+    assert alice["pnl_percentage"] == pytest.approx(500 / 1100 * 100)
+
+    bob = ranking["bob@example.com"]
+    assert (bob["total_invested"], bob["total_value"]) == (pytest.approx(1000), pytest.approx(900))
+    assert (bob["pnl_abs"], bob["pnl_percentage"]) == (pytest.approx(-100), pytest.approx(-10))
+
+    carol = ranking["carol@example.com"]
+    assert carol["name"] == "Unknown User"
+    assert (carol["total_value"], carol["pnl_percentage"]) == (0, 0)
+
+    ranks = {email: row["rank"] for email, row in ranking.items()}
+    assert ranks == {"alice@example.com": 1, "carol@example.com": 2, "bob@example.com": 3}
+
+
+def test_ranking_cache_invalidated_by_position_change(pg_client, pg_session, ranked_users, auth_headers):
+    """Тест кэша рейтинга: ответ из Redis до изменения позиций, пересчёт после"""
+    _, bob, _ = ranked_users
+    first = _ranking(pg_client)
+    assert ranking_cache._redis_client.exists(ranking_cache.RANKING_CACHE_KEY)
+
+    # Новая цена без изменения позиций - рейтинг отдаётся из кэша
+    pg_session.add(PriceEOD(symbol="TSLA", date=date(2024, 1, 3), close=400.0))
+    pg_session.commit()
+    assert _ranking(pg_client) == first
+
+    response = pg_client.post("/positions", headers=auth_headers(bob), json={
+        "symbol": "TSLA", "quantity": "5", "buy_price": "100"
+    })
+    assert response.status_code == 200
+    assert not ranking_cache._redis_client.exists(ranking_cache.RANKING_CACHE_KEY)
+
+    bob_row = _ranking(pg_client)["bob@example.com"]
+    assert bob_row["total_invested"] == pytest.approx(1500)
+    assert bob_row["total_value"] == pytest.approx(4000)
+    assert bob_row["rank"] == 1
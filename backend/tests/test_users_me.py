@@ -0,0 +1,34 @@
+"""
+Тесты /users/me: профиль из сессии, существование пользователя - через кэш (PostgreSQL, см. TEST_POSTGRES_URL)
+"""
+from sqlalchemy import delete
+
+from app.models import User
+from app.services import user_cache
+
+
+def test_me_serves_session_user(pg_client):
+    """Тест /me: после регистрации отдает email и name"""
+    pg_client.post("/users/register", params={"email": "me@example.com", "name": "Me"})
+
+    response = pg_client.get("/users/me")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["authenticated"], body["email"], body["name"]) == (True, "me@example.com", "Me")
+
+
+def test_me_clears_session_of_deleted_user(pg_client, pg_session):
+    """Тест /me: удаленный пользователь не считается вошедшим, сессия очищается"""
+    pg_client.post("/users/register", params={"email": "gone@example.com", "name": "Gone"})
+    assert pg_client.get("/users/me").json()["authenticated"] is True
+
+    user_id = pg_session.query(User.id).filter(User.email == "gone@example.com").scalar()
+    pg_session.execute(delete(User).where(User.id == user_id))
+    pg_session.commit()
+    user_cache.invalidate_user_cache(user_id)
+
+    assert pg_client.get("/users/me").json() == {"authenticated": False}
+    # Сессия очищена: повторный запрос не доходит до проверки пользователя
+    assert not pg_client.cookies.get("session")
+    assert pg_client.get("/users/me").json() == {"authenticated": False}